@@ -1,10 +1,10 @@
 import os
 from datetime import datetime
-from flask import Flask, redirect, url_for
+from flask import Flask, redirect, url_for, session
 from flask_login import LoginManager
 from flask_migrate import Migrate
 from config import Config
-from models import db, User
+from models import db, User, SessionUser
 
 login_manager = LoginManager()
 migrate = Migrate()
@@ -17,6 +17,8 @@ def create_app():
     
     @app.after_request
     def add_header(response):
+        if response.cache_control.private and response.get_etag()[0]:
+            return response
         response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
         response.headers['Pragma'] = 'no-cache'
         response.headers['Expires'] = '0'
@@ -32,13 +34,21 @@ def create_app():
     
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        session_user = SessionUser.from_snapshot(session.get('user_snapshot'), int(user_id))
+        if session_user:
+            return session_user
+        user = db.session.get(User, int(user_id))
+        if not user or not user.is_active:
+            session.pop('user_snapshot', None)
+            return None
+        session['user_snapshot'] = SessionUser.snapshot(user)
+        return user
     
     upload_folder = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
     if not os.path.exists(upload_folder):
         os.makedirs(upload_folder)
     
-    from routes.auth import auth_bp
+    from routes.auth import auth_bp, flush_audit_logs
     from routes.dashboard import dashboard_bp
     from routes.income import income_bp
     from routes.expenses import expenses_bp
@@ -56,6 +66,8 @@ def create_app():
     app.register_blueprint(admin_bp)
     app.register_blueprint(ai_assistant_bp)
     
+    app.teardown_request(flush_audit_logs)
+    
     @app.context_processor
     def inject_now():
         return {'now': datetime.utcnow}
@@ -10,7 +10,7 @@ class Config:
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ENGINE_OPTIONS = {
-        'pool_recycle': 300,
+        'pool_recycle': 280,
         'pool_pre_ping': True,
     }
     
@@ -23,8 +23,18 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif'}
     
+    # Let the front-end web server send upload files (Apache X-Sendfile / nginx X-Accel-Redirect)
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'false').lower() in ('1', 'true', 'yes')
+    UPLOAD_ACCEL_REDIRECT_PREFIX = os.environ.get('UPLOAD_ACCEL_REDIRECT_PREFIX')
+    
     ITEMS_PER_PAGE = 20
     
+    AUDIT_ENABLED = os.environ.get('AUDIT_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+    AUDIT_MIN_LEVEL = os.environ.get('AUDIT_MIN_LEVEL', 'info')
+    
+    # Make un-eager-loaded relationship access raise in views that opt in; off by default because main.py runs with debug=True
+    RAISE_ON_LAZY_LOAD = os.environ.get('RAISE_ON_LAZY_LOAD', 'false').lower() in ('1', 'true', 'yes')
+    
     FISCAL_YEAR_START_MONTH = 1
     
     APP_NAME = "MSJID E AMEER E MUAVIYYAH"
@@ -1,4 +1,6 @@
-from datetime import datetime
+import base64
+import time
+from datetime import datetime, date
 from decimal import Decimal
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
@@ -6,8 +8,27 @@ from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
+# {user_id: (expiry, {account code: account id})}; clear-data recreates accounts with new ids, and the TTL
+# bounds how long workers other than the one that ran it keep the old ids
+ACCOUNT_IDS_TTL = 60
+_account_ids_by_user = {}
 
-class User(UserMixin, db.Model):
+# {user_id: (expiry, frozenset of locked (year, month))}; the TTL bounds how long other workers can miss a new lock
+LOCKED_PERIODS_TTL = 30
+_locked_periods_by_user = {}
+
+
+class UserPermissions:
+    """Permission checks shared by User and SessionUser, so a session snapshot never grants more than the row"""
+    
+    def has_permission(self, permission):
+        return True
+    
+    def is_read_only(self):
+        return False
+
+
+class User(UserPermissions, UserMixin, db.Model):
     __tablename__ = 'users'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -34,12 +55,28 @@ class User(UserMixin, db.Model):
         if not self.password_hash:
             return False
         return check_password_hash(self.password_hash, password)
+
+
+class SessionUser(UserPermissions, UserMixin):
+    """Lightweight current_user rebuilt from the signed session instead of the users table"""
     
-    def has_permission(self, permission):
-        return True
+    # Seconds a snapshot is trusted before the users row is read again, so deactivation takes effect
+    TTL = 300
     
-    def is_read_only(self):
-        return False
+    def __init__(self, id, full_name):
+        self.id = id
+        self.full_name = full_name
+    
+    @staticmethod
+    def snapshot(user):
+        return {'id': user.id, 'full_name': user.full_name, 'taken_at': time.time()}
+    
+    @classmethod
+    def from_snapshot(cls, snapshot, user_id):
+        """The snapshot as a SessionUser, or None when it belongs to someone else or has expired"""
+        if snapshot and snapshot['id'] == user_id and snapshot.get('taken_at', 0) + cls.TTL > time.time():
+            return cls(snapshot['id'], snapshot['full_name'])
+        return None
 
 
 class FundType:
@@ -68,6 +105,8 @@ class AccountType:
     EXPENSE = 'expense'
     
     ALL_TYPES = [ASSET, LIABILITY, EQUITY, INCOME, EXPENSE]
+    
+    DEBIT_NORMAL_TYPES = frozenset({ASSET, EXPENSE})
 
 
 class Account(db.Model):
@@ -102,10 +141,54 @@ class Account(db.Model):
         total_debit = sum(e.debit_amount or Decimal('0') for e in entries)
         total_credit = sum(e.credit_amount or Decimal('0') for e in entries)
         
-        if self.account_type in [AccountType.ASSET, AccountType.EXPENSE]:
+        if self.account_type in AccountType.DEBIT_NORMAL_TYPES:
             return total_debit - total_credit
         else:
             return total_credit - total_debit
+    
+    @staticmethod
+    def get_balances(accounts, start_date=None, end_date=None):
+        """Balances for several accounts from one grouped query, keyed by account id"""
+        if not accounts:
+            return {}
+        
+        query = db.session.query(
+            JournalEntry.account_id,
+            db.func.sum(JournalEntry.debit_amount),
+            db.func.sum(JournalEntry.credit_amount)
+        ).filter(JournalEntry.account_id.in_([account.id for account in accounts]))
+        if start_date:
+            query = query.filter(JournalEntry.date >= start_date)
+        if end_date:
+            query = query.filter(JournalEntry.date <= end_date)
+        
+        totals = {account_id: (debit, credit) for account_id, debit, credit in query.group_by(JournalEntry.account_id)}
+        
+        balances = {}
+        for account in accounts:
+            total_debit, total_credit = totals.get(account.id, (None, None))
+            total_debit = total_debit or Decimal('0')
+            total_credit = total_credit or Decimal('0')
+            if account.account_type in AccountType.DEBIT_NORMAL_TYPES:
+                balances[account.id] = total_debit - total_credit
+            else:
+                balances[account.id] = total_credit - total_debit
+        return balances
+    
+    @staticmethod
+    def ids_by_code(user_id):
+        """Account ids for a user keyed by code, cached in-process for ACCOUNT_IDS_TTL seconds"""
+        cached = _account_ids_by_user.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        ids = dict(db.session.query(Account.code, Account.id).filter_by(user_id=user_id).all())
+        if ids:
+            _account_ids_by_user[user_id] = (time.monotonic() + ACCOUNT_IDS_TTL, ids)
+        return ids
+    
+    @staticmethod
+    def forget_ids(user_id):
+        _account_ids_by_user.pop(user_id, None)
 
 
 class JournalEntry(db.Model):
@@ -144,6 +227,18 @@ class Transaction(db.Model):
     created_by = db.relationship('User', foreign_keys=[created_by_id])
     reversal_of = db.relationship('Transaction', remote_side=[id], backref='reversed_by')
     journal_entries = db.relationship('JournalEntry', backref='transaction', lazy='dynamic', cascade='all, delete-orphan')
+    
+    @staticmethod
+    def insert_posting(transaction_values, entries):
+        """Insert a transaction and its journal entries with Core statements, returning the transaction id"""
+        transaction_id = db.session.execute(
+            Transaction.__table__.insert().values(**transaction_values).returning(Transaction.__table__.c.id)
+        ).scalar_one()
+        db.session.execute(
+            JournalEntry.__table__.insert(),
+            [dict(entry, transaction_id=transaction_id) for entry in entries]
+        )
+        return transaction_id
 
 
 class IncomeCategory:
@@ -260,6 +355,10 @@ class Income(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('user_id', 'receipt_number', name='unique_user_receipt'),
+        db.Index('ix_incomes_user_reversed_created', 'user_id', 'is_reversed', created_at.desc()),
+        db.Index('ix_incomes_user_reversed_date', 'user_id', 'is_reversed', date.desc(), created_at.desc()),
+        db.Index('ix_incomes_user_reversed_verification_date', 'user_id', 'is_reversed', 'verification_status', 'date'),
+        db.Index('ix_incomes_user_reversed_category_fund', 'user_id', 'is_reversed', 'category', 'fund_type'),
     )
     
     entered_by = db.relationship('User', foreign_keys=[entered_by_id])
@@ -271,13 +370,14 @@ class Income(db.Model):
     def generate_receipt_number(user_id):
         today = datetime.utcnow()
         prefix = f"RCP{today.strftime('%Y%m%d')}"
-        last_income = Income.query.filter(
+        # MAX over the (user_id, receipt_number) unique index reads one key instead of hydrating a row
+        last_receipt = db.session.query(db.func.max(Income.receipt_number)).filter(
             Income.user_id == user_id,
             Income.receipt_number.like(f"{prefix}%")
-        ).order_by(Income.receipt_number.desc()).first()
+        ).scalar()
         
-        if last_income:
-            last_num = int(last_income.receipt_number[-4:])
+        if last_receipt:
+            last_num = int(last_receipt[-4:])
             new_num = last_num + 1
         else:
             new_num = 1
@@ -351,6 +451,11 @@ class Expense(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('user_id', 'voucher_number', name='unique_user_voucher'),
+        db.Index('ix_expenses_user_reversed_created', 'user_id', 'is_reversed', created_at.desc()),
+        db.Index('ix_expenses_user_reversed_date', 'user_id', 'is_reversed', date.desc(), created_at.desc()),
+        db.Index('ix_expenses_user_reversed_verification', 'user_id', 'is_reversed', 'verification_status'),
+        db.Index('ix_expenses_user_reversed_approval_date', 'user_id', 'is_reversed', 'approval_status', 'date'),
+        db.Index('ix_expenses_user_reversed_category_fund', 'user_id', 'is_reversed', 'category', 'fund_type'),
     )
     
     entered_by = db.relationship('User', foreign_keys=[entered_by_id])
@@ -391,6 +496,11 @@ class AuditLog(db.Model):
     ip_address = db.Column(db.String(45))
     user_agent = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        db.Index('ix_audit_logs_user_created', 'user_id', created_at.desc()),
+        db.Index('ix_audit_logs_entity', 'entity_type', 'entity_id'),
+    )
 
 
 class AppSettings(db.Model):
@@ -418,6 +528,16 @@ class AppSettings(db.Model):
         db.session.commit()
         return setting
     
+    @staticmethod
+    def set_settings(values):
+        existing = {s.key: s for s in AppSettings.query.filter(AppSettings.key.in_(list(values))).all()}
+        for key, value in values.items():
+            if key in existing:
+                existing[key].value = value
+            else:
+                db.session.add(AppSettings(key=key, value=value))
+        db.session.commit()
+    
     @staticmethod
     def get_all_settings():
         settings = AppSettings.query.all()
@@ -434,6 +554,10 @@ class AIChatHistory(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     user = db.relationship('User', backref='ai_chats')
+    
+    __table_args__ = (
+        db.Index('ix_ai_chat_history_user_created', 'user_id', created_at.desc()),
+    )
 
 
 class PeriodLock(db.Model):
@@ -453,16 +577,92 @@ class PeriodLock(db.Model):
         db.UniqueConstraint('user_id', 'year', 'month', name='unique_user_period_lock'),
     )
     
+    @staticmethod
+    def locked_periods(user_id):
+        """The user's locked (year, month) pairs, cached in-process for LOCKED_PERIODS_TTL seconds"""
+        cached = _locked_periods_by_user.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        periods = frozenset(
+            (year, month) for year, month in
+            db.session.query(PeriodLock.year, PeriodLock.month).filter_by(user_id=user_id).all()
+        )
+        _locked_periods_by_user[user_id] = (time.monotonic() + LOCKED_PERIODS_TTL, periods)
+        return periods
+    
+    @staticmethod
+    def forget_locked_periods(user_id):
+        _locked_periods_by_user.pop(user_id, None)
+    
     @staticmethod
     def is_period_locked(user_id, date):
-        return PeriodLock.query.filter_by(
-            user_id=user_id,
-            year=date.year,
-            month=date.month
-        ).first() is not None
+        return (date.year, date.month) in PeriodLock.locked_periods(user_id)
 
 
-def create_default_accounts_for_user(user_id):
+class KeysetPage:
+    """A page of rows ordered by descending key columns, navigated by cursor rather than OFFSET"""
+    
+    def __init__(self, items, prev_cursor=None, next_cursor=None):
+        self.items = items
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        self.has_prev = prev_cursor is not None
+        self.has_next = next_cursor is not None
+    
+    @staticmethod
+    def encode_cursor(row, columns):
+        values = [getattr(row, column.key) for column in columns]
+        raw = '|'.join(value.isoformat() if isinstance(value, date) else str(value) for value in values)
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+    
+    @staticmethod
+    def decode_cursor(cursor, columns):
+        try:
+            parts = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            if len(parts) != len(columns):
+                return None
+            values = []
+            for column, part in zip(columns, parts):
+                python_type = column.type.python_type
+                if python_type in (date, datetime):
+                    values.append(python_type.fromisoformat(part))
+                else:
+                    values.append(python_type(part))
+            return values
+        except (ValueError, TypeError, NotImplementedError):
+            return None
+    
+    @classmethod
+    def fetch(cls, query, columns, after=None, before=None, per_page=20):
+        key = db.tuple_(*columns)
+        
+        before_values = cls.decode_cursor(before, columns) if before else None
+        if before_values:
+            rows = query.filter(key > db.tuple_(*before_values)).order_by(
+                *[column.asc() for column in columns]
+            ).limit(per_page + 1).all()
+            items = rows[:per_page][::-1]
+            has_prev, has_next = len(rows) > per_page, True
+        else:
+            after_values = cls.decode_cursor(after, columns) if after else None
+            if after_values:
+                query = query.filter(key < db.tuple_(*after_values))
+            rows = query.order_by(
+                *[column.desc() for column in columns]
+            ).limit(per_page + 1).all()
+            items = rows[:per_page]
+            has_prev, has_next = after_values is not None, len(rows) > per_page
+        
+        if not items:
+            return cls(items)
+        return cls(
+            items,
+            prev_cursor=cls.encode_cursor(items[0], columns) if has_prev else None,
+            next_cursor=cls.encode_cursor(items[-1], columns) if has_next else None
+        )
+
+
+def create_default_accounts_for_user(user_id, commit=True):
     """Create default chart of accounts for a masjid"""
     default_accounts = [
         ('1000', 'Cash in Hand (نقدی)', AccountType.ASSET, FundType.GENERAL, 'Physical cash in masjid'),
@@ -504,18 +704,26 @@ def create_default_accounts_for_user(user_id):
         ('5100', 'Other Expenses (دیگر)', AccountType.EXPENSE, FundType.GENERAL, 'Miscellaneous expenses'),
     ]
     
-    for code, name, acc_type, fund_type, description in default_accounts:
-        existing = Account.query.filter_by(user_id=user_id, code=code).first()
-        if not existing:
-            account = Account(
-                user_id=user_id,
-                code=code,
-                name=name,
-                account_type=acc_type,
-                fund_type=fund_type,
-                description=description,
-                is_active=True
-            )
-            db.session.add(account)
-    
-    db.session.commit()
+    existing_codes = {
+        code for (code,) in db.session.query(Account.code).filter_by(user_id=user_id).all()
+    }
+    rows = [
+        {
+            'user_id': user_id,
+            'code': code,
+            'name': name,
+            'account_type': acc_type,
+            'fund_type': fund_type,
+            'description': description,
+            'is_active': True
+        }
+        for code, name, acc_type, fund_type, description in default_accounts
+        if code not in existing_codes
+    ]
+    
+    if rows:
+        db.session.execute(Account.__table__.insert(), rows)
+        Account.forget_ids(user_id)
+    
+    if commit:
+        db.session.commit()
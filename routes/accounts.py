@@ -62,7 +62,7 @@ def ledger(id):
     running_balance = opening_balance
     entries_with_balance = []
     for entry in entries.items:
-        if account.account_type in [AccountType.ASSET, AccountType.EXPENSE]:
+        if account.account_type in AccountType.DEBIT_NORMAL_TYPES:
             running_balance += (entry.debit_amount or Decimal('0')) - (entry.credit_amount or Decimal('0'))
         else:
             running_balance += (entry.credit_amount or Decimal('0')) - (entry.debit_amount or Decimal('0'))
@@ -101,7 +101,7 @@ def trial_balance():
         balance = account.get_balance(end_date=end_date)
         
         if balance != 0:
-            if account.account_type in [AccountType.ASSET, AccountType.EXPENSE]:
+            if account.account_type in AccountType.DEBIT_NORMAL_TYPES:
                 if balance >= 0:
                     debit = balance
                     credit = Decimal('0')
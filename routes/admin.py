@@ -1,8 +1,11 @@
 from datetime import datetime
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload
 from models import db, User, AuditLog, PeriodLock, AppSettings, Income, Expense, Account, Transaction, JournalEntry, AIChatHistory, create_default_accounts_for_user
 from routes.auth import log_action
+from routes.dashboard import invalidate_dashboard_cache
+from routes.reports import invalidate_report_cache
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -36,6 +39,9 @@ def clear_data():
         
         # Recreate defaults
         create_default_accounts_for_user(current_user.id)
+        invalidate_dashboard_cache(current_user.id)
+        invalidate_report_cache(current_user.id)
+        PeriodLock.forget_locked_periods(current_user.id)
         
         log_action('clear_data', 'system', None, None, None, 'Cleared all transactional data')
         flash('All transaction data has been cleared. Accounts have been reset to default.', 'success')
@@ -54,7 +60,7 @@ def audit_log():
     action_filter = request.args.get('action', '')
     entity_filter = request.args.get('entity', '')
     
-    query = AuditLog.query.filter_by(user_id=current_user.id)
+    query = AuditLog.query.options(joinedload(AuditLog.user)).filter_by(user_id=current_user.id)
     
     if action_filter:
         query = query.filter_by(action=action_filter)
@@ -97,8 +103,10 @@ def create_period_lock():
         flash('Invalid year or month.', 'danger')
         return redirect(url_for('admin.period_locks'))
     
-    existing = PeriodLock.query.filter_by(user_id=current_user.id, year=year, month=month).first()
-    if existing:
+    already_locked = db.session.query(
+        PeriodLock.query.filter_by(user_id=current_user.id, year=year, month=month).exists()
+    ).scalar()
+    if already_locked:
         flash('This period is already locked.', 'warning')
         return redirect(url_for('admin.period_locks'))
     
@@ -112,6 +120,7 @@ def create_period_lock():
     
     db.session.add(lock)
     db.session.commit()
+    PeriodLock.forget_locked_periods(current_user.id)
     
     log_action('create', 'period_lock', lock.id, None, {
         'year': year,
@@ -129,6 +138,7 @@ def delete_period_lock(id):
     year, month = lock.year, lock.month
     db.session.delete(lock)
     db.session.commit()
+    PeriodLock.forget_locked_periods(current_user.id)
     
     log_action('delete', 'period_lock', id, {'year': year, 'month': month}, None)
     
@@ -146,26 +156,24 @@ def settings():
 @admin_bp.route('/settings/update', methods=['POST'])
 @login_required
 def update_settings():
-    app_name = request.form.get('app_name', '').strip()
-    app_name_arabic = request.form.get('app_name_arabic', '').strip()
-    app_tagline = request.form.get('app_tagline', '').strip()
-    currency_symbol = request.form.get('currency_symbol', '').strip()
-    currency_code = request.form.get('currency_code', '').strip()
+    submitted = {
+        'app_name': request.form.get('app_name', '').strip(),
+        'app_name_arabic': request.form.get('app_name_arabic', '').strip(),
+        'app_tagline': request.form.get('app_tagline', '').strip(),
+        'currency_symbol': request.form.get('currency_symbol', '').strip(),
+        'currency_code': request.form.get('currency_code', '').strip(),
+    }
     
     old_settings = AppSettings.get_all_settings()
+    changes = {key: value for key, value in submitted.items() if value and old_settings.get(key) != value}
     
-    if app_name:
-        AppSettings.set_setting('app_name', app_name)
-    if app_name_arabic:
-        AppSettings.set_setting('app_name_arabic', app_name_arabic)
-    if app_tagline:
-        AppSettings.set_setting('app_tagline', app_tagline)
-    if currency_symbol:
-        AppSettings.set_setting('currency_symbol', currency_symbol)
-    if currency_code:
-        AppSettings.set_setting('currency_code', currency_code)
-    
-    new_settings = AppSettings.get_all_settings()
+    if not changes:
+        flash('No settings were changed.', 'info')
+        return redirect(url_for('admin.settings'))
+    
+    AppSettings.set_settings(changes)
+    
+    new_settings = {**old_settings, **changes}
     log_action('update', 'app_settings', None, old_settings, new_settings, 'Updated application settings')
     
     flash('Settings updated successfully.', 'success')
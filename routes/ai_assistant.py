@@ -1,6 +1,8 @@
+import re
 from datetime import datetime
 from flask import Blueprint, render_template, request, jsonify
 from flask_login import login_required, current_user
+from sqlalchemy.orm import aliased
 from models import db, AIChatHistory
 
 ai_assistant_bp = Blueprint('ai_assistant', __name__, url_prefix='/ai')
@@ -41,67 +43,131 @@ ISLAMIC_KNOWLEDGE_BASE = {
     }
 }
 
+def _prayer_response(message_lower):
+    if 'time' in message_lower or 'when' in message_lower:
+        response = "The five daily prayers (Salah) are:\n\n"
+        for name, desc in ISLAMIC_KNOWLEDGE_BASE['prayer_times'].items():
+            response += f"- **{name.title()}**: {desc}\n"
+        response += "\n*Prayer times vary by location and season. Please check local prayer times.*"
+        return response
+    return "Salah (prayer) is the second pillar of Islam. Muslims are required to pray five times daily: Fajr (dawn), Dhuhr (noon), Asr (afternoon), Maghrib (sunset), and Isha (night). Each prayer involves specific physical movements and recitations from the Quran."
+
+
+def _pillars_response(message_lower):
+    response = "The **Five Pillars of Islam** are the foundation of Muslim life:\n\n"
+    for i, pillar in enumerate(ISLAMIC_KNOWLEDGE_BASE['pillars'], 1):
+        response += f"{i}. {pillar}\n\n"
+    return response
+
+
+def _zakat_response(message_lower):
+    return "**Zakat** is the third pillar of Islam and refers to obligatory charity. Muslims who possess wealth above a certain threshold (nisab) must give 2.5% of their savings annually to those in need.\n\n**Sadaqah** is voluntary charity given beyond the obligatory Zakat. Both forms of giving are highly encouraged in Islam and purify one's wealth.\n\n*This accounting system helps you track Zakat and Sadaqah separately to maintain proper Islamic financial records.*"
+
+
+def _ramadan_response(message_lower):
+    return "**Ramadan** is the ninth month of the Islamic calendar during which Muslims fast from dawn to sunset. Fasting (Sawm) is the fourth pillar of Islam.\n\nDuring Ramadan:\n- Muslims abstain from food, drink, and other physical needs from Fajr to Maghrib\n- It is a time for spiritual reflection, increased devotion, and worship\n- The Night of Power (Laylat al-Qadr) falls within the last ten nights\n- Eid al-Fitr celebrates the end of Ramadan"
+
+
+def _greetings_response(message_lower):
+    response = "**Islamic Greetings and Phrases:**\n\n"
+    for name, meaning in ISLAMIC_KNOWLEDGE_BASE['greetings'].items():
+        response += f"- {meaning}\n"
+    return response
+
+
+def _duas_response(message_lower):
+    response = "**Common Islamic Duas (Supplications):**\n\n"
+    for occasion, dua in ISLAMIC_KNOWLEDGE_BASE['duas'].items():
+        response += f"- **{occasion.replace('_', ' ').title()}**: {dua}\n\n"
+    return response
+
+
+def _quran_response(message_lower):
+    return "The **Quran** is the holy book of Islam, believed to be the word of Allah revealed to Prophet Muhammad (PBUH) through the angel Jibreel (Gabriel) over 23 years.\n\nThe Quran consists of:\n- 114 Surahs (chapters)\n- 6,236 verses (ayahs)\n- Guidance for all aspects of life\n\nReading and memorizing the Quran is highly rewarded in Islam. The month of Ramadan is especially significant as the Quran was first revealed during this time."
+
+
+def _hajj_response(message_lower):
+    return "**Hajj** is the fifth pillar of Islam - the pilgrimage to Mecca that every able Muslim must perform at least once in their lifetime.\n\nKey elements of Hajj:\n- **Tawaf**: Circling the Kaaba seven times\n- **Sa'i**: Walking between the hills of Safa and Marwa\n- **Day of Arafah**: Standing in prayer on the plains of Arafat\n- **Stoning of the Devil**: Symbolic rejection of evil\n\nHajj occurs in the Islamic month of Dhul Hijjah, and Eid al-Adha is celebrated at its conclusion."
+
+
+def _help_response(message_lower):
+    return "**Welcome to Islamic AI Assistant!** I can help you with:\n\n- **Prayer Times**: Information about the five daily prayers\n- **Pillars of Islam**: Learn about the foundations of Muslim faith\n- **Zakat & Charity**: Understanding Islamic charitable giving\n- **Ramadan & Fasting**: Information about the holy month\n- **Islamic Greetings**: Common phrases and their meanings\n- **Duas**: Supplications for various occasions\n- **Quran**: Information about the holy book\n- **Hajj**: The pilgrimage to Mecca\n\nFeel free to ask any questions about Islamic teachings!"
+
+
+def _bismillah_response(message_lower):
+    return "**Bismillah ir-Rahman ir-Rahim**\n\nبِسْمِ اللهِ الرَّحْمٰنِ الرَّحِيْمِ\n\nMeaning: *In the name of Allah, the Most Gracious, the Most Merciful*\n\nThis phrase begins 113 of the 114 chapters of the Quran and is recited by Muslims before undertaking any significant action."
+
+
+def _allah_response(message_lower):
+    return "**Allah** is the Arabic word for God. In Islam, Allah is:\n\n- The One and Only God\n- The Creator of all that exists\n- All-Knowing (Al-Alim)\n- All-Merciful (Ar-Rahman)\n- The Most Gracious (Ar-Rahim)\n\nAllah has 99 beautiful names (Asma ul-Husna) that describe His attributes. Muslims worship Allah alone and believe there is no god but Him."
+
+
+def _default_response(message_lower):
+    return "**Assalamu Alaikum!** Peace be upon you.\n\nI'm your Islamic AI Assistant. I can help you learn about:\n\n- The Five Pillars of Islam\n- Prayer times and Salah\n- Zakat and Sadaqah (charity)\n- Ramadan and fasting\n- Common Islamic greetings and duas\n- The Holy Quran\n- Hajj pilgrimage\n\nPlease ask me anything about Islamic teachings, and I'll do my best to assist you!\n\n*Jazak Allah Khair*"
+
+
+# Checked in order; the first intent with a matching keyword wins.
+AI_INTENT_KEYWORDS = [
+    ('prayer', ['prayer', 'salah', 'namaz', 'pray']),
+    ('pillars', ['pillar', 'arkaan', 'foundation']),
+    ('zakat', ['zakat', 'charity', 'sadaqah']),
+    ('ramadan', ['ramadan', 'fasting', 'sawm', 'roza']),
+    ('greetings', ['greeting', 'salam', 'hello', 'assalam']),
+    ('duas', ['dua', 'supplication', 'pray for']),
+    ('quran', ['quran', 'book', 'scripture']),
+    ('hajj', ['hajj', 'pilgrimage', 'mecca', 'kaaba']),
+    ('help', ['help', 'what can you', 'how can you']),
+    ('bismillah', ['bismillah', 'start', 'begin']),
+    ('allah', ['allah', 'god']),
+]
+
+AI_RESPONSE_HANDLERS = {
+    'prayer': _prayer_response,
+    'pillars': _pillars_response,
+    'zakat': _zakat_response,
+    'ramadan': _ramadan_response,
+    'greetings': _greetings_response,
+    'duas': _duas_response,
+    'quran': _quran_response,
+    'hajj': _hajj_response,
+    'help': _help_response,
+    'bismillah': _bismillah_response,
+    'allah': _allah_response,
+}
+
+
+AI_INTENT_PRIORITY = {intent: rank for rank, (intent, _) in enumerate(AI_INTENT_KEYWORDS)}
+
+AI_KEYWORD_TO_INTENT = {
+    keyword: intent
+    for intent, keywords in AI_INTENT_KEYWORDS
+    for keyword in keywords
+}
+
+# Zero-width lookahead so overlapping keywords (e.g. 'pray' / 'pray for') are all seen in one scan
+AI_KEYWORD_RE = re.compile('(?=(' + '|'.join(re.escape(k) for k in AI_KEYWORD_TO_INTENT) + '))')
+
+
+def _detect_intent(message_lower):
+    intents = {AI_KEYWORD_TO_INTENT[m.group(1)] for m in AI_KEYWORD_RE.finditer(message_lower)}
+    return min(intents, key=AI_INTENT_PRIORITY.__getitem__, default=None)
+
+
 def get_ai_response(message):
     message_lower = message.lower()
-    
-    if any(word in message_lower for word in ['prayer', 'salah', 'namaz', 'pray']):
-        if 'time' in message_lower or 'when' in message_lower:
-            response = "The five daily prayers (Salah) are:\n\n"
-            for name, desc in ISLAMIC_KNOWLEDGE_BASE['prayer_times'].items():
-                response += f"- **{name.title()}**: {desc}\n"
-            response += "\n*Prayer times vary by location and season. Please check local prayer times.*"
-            return response
-        else:
-            return "Salah (prayer) is the second pillar of Islam. Muslims are required to pray five times daily: Fajr (dawn), Dhuhr (noon), Asr (afternoon), Maghrib (sunset), and Isha (night). Each prayer involves specific physical movements and recitations from the Quran."
-    
-    elif any(word in message_lower for word in ['pillar', 'arkaan', 'foundation']):
-        response = "The **Five Pillars of Islam** are the foundation of Muslim life:\n\n"
-        for i, pillar in enumerate(ISLAMIC_KNOWLEDGE_BASE['pillars'], 1):
-            response += f"{i}. {pillar}\n\n"
-        return response
-    
-    elif any(word in message_lower for word in ['zakat', 'charity', 'sadaqah']):
-        return "**Zakat** is the third pillar of Islam and refers to obligatory charity. Muslims who possess wealth above a certain threshold (nisab) must give 2.5% of their savings annually to those in need.\n\n**Sadaqah** is voluntary charity given beyond the obligatory Zakat. Both forms of giving are highly encouraged in Islam and purify one's wealth.\n\n*This accounting system helps you track Zakat and Sadaqah separately to maintain proper Islamic financial records.*"
-    
-    elif any(word in message_lower for word in ['ramadan', 'fasting', 'sawm', 'roza']):
-        return "**Ramadan** is the ninth month of the Islamic calendar during which Muslims fast from dawn to sunset. Fasting (Sawm) is the fourth pillar of Islam.\n\nDuring Ramadan:\n- Muslims abstain from food, drink, and other physical needs from Fajr to Maghrib\n- It is a time for spiritual reflection, increased devotion, and worship\n- The Night of Power (Laylat al-Qadr) falls within the last ten nights\n- Eid al-Fitr celebrates the end of Ramadan"
-    
-    elif any(word in message_lower for word in ['greeting', 'salam', 'hello', 'assalam']):
-        response = "**Islamic Greetings and Phrases:**\n\n"
-        for name, meaning in ISLAMIC_KNOWLEDGE_BASE['greetings'].items():
-            response += f"- {meaning}\n"
-        return response
-    
-    elif any(word in message_lower for word in ['dua', 'supplication', 'pray for']):
-        response = "**Common Islamic Duas (Supplications):**\n\n"
-        for occasion, dua in ISLAMIC_KNOWLEDGE_BASE['duas'].items():
-            response += f"- **{occasion.replace('_', ' ').title()}**: {dua}\n\n"
-        return response
-    
-    elif any(word in message_lower for word in ['quran', 'book', 'scripture']):
-        return "The **Quran** is the holy book of Islam, believed to be the word of Allah revealed to Prophet Muhammad (PBUH) through the angel Jibreel (Gabriel) over 23 years.\n\nThe Quran consists of:\n- 114 Surahs (chapters)\n- 6,236 verses (ayahs)\n- Guidance for all aspects of life\n\nReading and memorizing the Quran is highly rewarded in Islam. The month of Ramadan is especially significant as the Quran was first revealed during this time."
-    
-    elif any(word in message_lower for word in ['hajj', 'pilgrimage', 'mecca', 'kaaba']):
-        return "**Hajj** is the fifth pillar of Islam - the pilgrimage to Mecca that every able Muslim must perform at least once in their lifetime.\n\nKey elements of Hajj:\n- **Tawaf**: Circling the Kaaba seven times\n- **Sa'i**: Walking between the hills of Safa and Marwa\n- **Day of Arafah**: Standing in prayer on the plains of Arafat\n- **Stoning of the Devil**: Symbolic rejection of evil\n\nHajj occurs in the Islamic month of Dhul Hijjah, and Eid al-Adha is celebrated at its conclusion."
-    
-    elif any(word in message_lower for word in ['help', 'what can you', 'how can you']):
-        return "**Welcome to Islamic AI Assistant!** I can help you with:\n\n- **Prayer Times**: Information about the five daily prayers\n- **Pillars of Islam**: Learn about the foundations of Muslim faith\n- **Zakat & Charity**: Understanding Islamic charitable giving\n- **Ramadan & Fasting**: Information about the holy month\n- **Islamic Greetings**: Common phrases and their meanings\n- **Duas**: Supplications for various occasions\n- **Quran**: Information about the holy book\n- **Hajj**: The pilgrimage to Mecca\n\nFeel free to ask any questions about Islamic teachings!"
-    
-    elif any(word in message_lower for word in ['bismillah', 'start', 'begin']):
-        return "**Bismillah ir-Rahman ir-Rahim**\n\nبِسْمِ اللهِ الرَّحْمٰنِ الرَّحِيْمِ\n\nMeaning: *In the name of Allah, the Most Gracious, the Most Merciful*\n\nThis phrase begins 113 of the 114 chapters of the Quran and is recited by Muslims before undertaking any significant action."
-    
-    elif any(word in message_lower for word in ['allah', 'god']):
-        return "**Allah** is the Arabic word for God. In Islam, Allah is:\n\n- The One and Only God\n- The Creator of all that exists\n- All-Knowing (Al-Alim)\n- All-Merciful (Ar-Rahman)\n- The Most Gracious (Ar-Rahim)\n\nAllah has 99 beautiful names (Asma ul-Husna) that describe His attributes. Muslims worship Allah alone and believe there is no god but Him."
-    
-    else:
-        return "**Assalamu Alaikum!** Peace be upon you.\n\nI'm your Islamic AI Assistant. I can help you learn about:\n\n- The Five Pillars of Islam\n- Prayer times and Salah\n- Zakat and Sadaqah (charity)\n- Ramadan and fasting\n- Common Islamic greetings and duas\n- The Holy Quran\n- Hajj pilgrimage\n\nPlease ask me anything about Islamic teachings, and I'll do my best to assist you!\n\n*Jazak Allah Khair*"
+    handler = AI_RESPONSE_HANDLERS.get(_detect_intent(message_lower), _default_response)
+    return handler(message_lower)
 
 
 @ai_assistant_bp.route('/')
 @login_required
 def index():
-    chat_history = AIChatHistory.query.filter_by(user_id=current_user.id).order_by(AIChatHistory.created_at.desc()).limit(20).all()
-    return render_template('ai/index.html', chat_history=chat_history[::-1])
+    latest = AIChatHistory.query.filter_by(user_id=current_user.id).order_by(
+        AIChatHistory.created_at.desc()
+    ).limit(20).subquery()
+    recent_chat = aliased(AIChatHistory, latest)
+    chat_history = db.session.query(recent_chat).order_by(recent_chat.created_at.asc()).all()
+    return render_template('ai/index.html', chat_history=chat_history)
 
 
 @ai_assistant_bp.route('/chat', methods=['POST'])
@@ -0,0 +1,17 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+# Plain positive decimals with up to 13 whole digits and 2 decimals, matching Numeric(15, 2); also keeps
+# 'NaN', 'Infinity' and exponents away from Decimal()
+AMOUNT_RE = re.compile(r'\d{1,13}(\.\d{0,2})?|\.\d{1,2}')
+CENT = Decimal('0.01')
+
+def parse_amount(value):
+    """Parse a posted amount into a positive Decimal, raising InvalidOperation for anything else"""
+    value = value.strip()
+    if not AMOUNT_RE.fullmatch(value):
+        raise InvalidOperation()
+    amount = Decimal(value).quantize(CENT)
+    if amount <= 0:
+        raise InvalidOperation()
+    return amount
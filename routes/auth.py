@@ -1,29 +1,127 @@
 from datetime import datetime
 from functools import wraps
-import json
+import atexit
+import hashlib
+import hmac
 import os
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+import queue
+import threading
+import time
+import orjson
+from flask import Blueprint, render_template, redirect, url_for, flash, request, g, current_app, session
 from flask_login import login_user, logout_user, login_required, current_user
-from models import db, User, AuditLog, create_default_accounts_for_user
+from models import db, User, SessionUser, AuditLog, AppSettings, create_default_accounts_for_user
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL = 0.2
+
+REMEMBER_ME_VALUES = frozenset({'true', 'on', '1', 'yes'})
+
+AUDIT_LEVELS = {'info': 0, 'critical': 1}
+AUDIT_ACTION_LEVELS = {
+    'logout': 'info',
+}
+
+_audit_queue = queue.Queue()
+_audit_worker = None
+_audit_worker_lock = threading.Lock()
+
+def _audit_client_info():
+    info = g.get('audit_client_info')
+    if info is None:
+        user_agent = request.user_agent.string
+        info = g.audit_client_info = (request.remote_addr, user_agent[:255] if user_agent else None)
+    return info
+
 def log_action(action, entity_type, entity_id=None, old_values=None, new_values=None, remarks=None):
+    # Audit rows are queued on the request and handed to the background writer by flush_audit_logs
+    if not current_app.config.get('AUDIT_ENABLED', True):
+        return
+    level = AUDIT_ACTION_LEVELS.get(action, 'critical')
+    if AUDIT_LEVELS[level] < AUDIT_LEVELS.get(current_app.config['AUDIT_MIN_LEVEL'], 0):
+        return
+    if action == 'update' and old_values == new_values:
+        return
+    
     if current_user.is_authenticated:
-        from models import AuditLog
-        log = AuditLog(
-            user_id=current_user.id,
-            action=action,
-            entity_type=entity_type,
-            entity_id=entity_id,
-            old_values=json.dumps(old_values) if old_values else None,
-            new_values=json.dumps(new_values) if new_values else None,
-            remarks=remarks,
-            ip_address=request.remote_addr,
-            user_agent=request.user_agent.string[:255] if request.user_agent.string else None
-        )
-        db.session.add(log)
-        db.session.commit()
+        ip_address, user_agent = _audit_client_info()
+        g.setdefault('pending_audit_logs', []).append({
+            'user_id': current_user.id,
+            'action': action,
+            'entity_type': entity_type,
+            'entity_id': entity_id,
+            # Serialized here so an unserializable value fails in the request that logged it
+            'old_values': _dump_audit_values(old_values),
+            'new_values': _dump_audit_values(new_values),
+            'remarks': remarks,
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'created_at': datetime.utcnow()
+        })
+
+def flush_audit_logs(exception=None):
+    pending = g.pop('pending_audit_logs', None)
+    if not pending or exception is not None:
+        return
+    
+    _start_audit_worker(current_app._get_current_object())
+    _audit_queue.put(pending)
+
+def _dump_audit_values(values):
+    return orjson.dumps(values).decode() if values else None
+
+def _write_audit_rows(app, rows):
+    with app.app_context():
+        try:
+            db.session.execute(AuditLog.__table__.insert(), rows)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error writing audit log: {str(e)}")
+
+def _run_audit_worker(app):
+    while True:
+        rows = list(_audit_queue.get())
+        deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+        while len(rows) < AUDIT_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                rows.extend(_audit_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        _write_audit_rows(app, rows)
+
+def _flush_audit_queue(app):
+    rows = []
+    while True:
+        try:
+            rows.extend(_audit_queue.get_nowait())
+        except queue.Empty:
+            break
+    if rows:
+        _write_audit_rows(app, rows)
+
+def _start_audit_worker(app):
+    # Started lazily so each gunicorn worker process gets its own thread after fork
+    global _audit_worker
+    if _audit_worker is not None and _audit_worker.is_alive():
+        return
+    with _audit_worker_lock:
+        if _audit_worker is None or not _audit_worker.is_alive():
+            _audit_worker = threading.Thread(target=_run_audit_worker, args=(app,), name='audit-writer', daemon=True)
+            _audit_worker.start()
+            atexit.register(_flush_audit_queue, app)
+
+def _login_page_etag():
+    template_path = os.path.join(current_app.root_path, current_app.template_folder, 'auth', 'login.html')
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(str(os.stat(template_path).st_mtime_ns).encode())
+    digest.update(orjson.dumps(AppSettings.get_all_settings(), option=orjson.OPT_SORT_KEYS))
+    return digest.hexdigest()
 
 def permission_required(permission):
     def decorator(f):
@@ -36,10 +134,8 @@ def permission_required(permission):
     return decorator
 
 def read_only_check(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        return f(*args, **kwargs)
-    return decorated_function
+    # There are no read-only users yet, so skip the extra wrapper frame on every request
+    return f
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -54,10 +150,13 @@ def login():
         
         email = request.form.get('email', '').strip().lower()
         password = request.form.get('password', '')
-        remember = request.form.get('remember', False)
+        remember = request.form.get('remember', '') in REMEMBER_ME_VALUES
+        
+        # Compare both fields in constant time so response timing doesn't reveal which one matched
+        email_matches = hmac.compare_digest(email.encode(), admin_email.encode())
+        password_matches = hmac.compare_digest(password.encode(), admin_password.encode())
         
-        if email == admin_email and password == admin_password:
-            from models import User, create_default_accounts_for_user
+        if email_matches and password_matches:
             user = User.query.filter_by(email=email).first()
             if not user:
                 # Create the one user if they don't exist
@@ -69,10 +168,11 @@ def login():
                 )
                 user.set_password(password)
                 db.session.add(user)
-                db.session.commit()
-                create_default_accounts_for_user(user.id)
+                db.session.flush()
+                create_default_accounts_for_user(user.id, commit=False)
             
-            login_user(user, remember=remember == 'true' or remember is True)
+            login_user(user, remember=remember)
+            session['user_snapshot'] = SessionUser.snapshot(user)
             user.last_login = datetime.utcnow()
             db.session.commit()
             
@@ -82,6 +182,18 @@ def login():
         else:
             flash('Invalid access credentials.', 'danger')
     
+    # The bare form only depends on the template and app settings; pages carrying flashes always render
+    if request.method == 'GET' and not session.get('_flashes'):
+        etag = _login_page_etag()
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(render_template('auth/login.html'))
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    
     return render_template('auth/login.html')
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
@@ -94,5 +206,6 @@ def register():
 def logout():
     log_action('logout', 'user', current_user.id)
     logout_user()
+    session.pop('user_snapshot', None)
     flash('You have been logged out successfully.', 'success')
     return redirect(url_for('auth.login'))
@@ -1,151 +1,195 @@
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, date
 from decimal import Decimal
 from flask import Blueprint, render_template
 from flask_login import login_required, current_user
-from sqlalchemy import func
-from models import (db, Income, Expense, Account, AccountType, FundType,
+from sqlalchemy import func, case, extract
+from models import (db, Income, Expense, Account, JournalEntry, AccountType, FundType,
                    VerificationStatus, ApprovalStatus, IncomeCategory)
 
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
 
-@dashboard_bp.route('/')
-@login_required
-def index():
-    today = datetime.utcnow().date()
+CHART_MONTHS = 6
+
+# Aggregates are cached per user for this many seconds; writes invalidate them
+DASHBOARD_CACHE_TTL = 60
+
+CASH_ACCOUNT_CODE = '1000'
+BANK_ACCOUNT_CODES = ['1010', '1020', '1030']
+
+RESTRICTED_INCOME_CATEGORIES = [
+    IncomeCategory.ZAKAT,
+    IncomeCategory.SADAQAH,
+    IncomeCategory.FITRAH,
+    IncomeCategory.FIDYAH,
+    IncomeCategory.KAFFARAH,
+    IncomeCategory.AQEEQAH,
+    IncomeCategory.QURBANI
+]
+
+_dashboard_cache = {}
+
+def _month_starts(first_of_month, count):
+    year, month = first_of_month.year, first_of_month.month
+    starts = []
+    for _ in range(count):
+        starts.append(date(year, month, 1))
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return starts[::-1]
+
+def _begin_read_only_snapshot():
+    # Execution options only apply at the start of a session transaction, so end any autobegun one first;
+    # a read-only page has nothing to keep, and rolling back can never persist a stray change
+    if db.session.new or db.session.dirty or db.session.deleted:
+        raise RuntimeError('Unsaved session changes before a read-only snapshot')
+    db.session.rollback()
+    if db.engine.dialect.name == 'postgresql':
+        db.session.connection(execution_options={
+            'isolation_level': 'REPEATABLE READ',
+            'postgresql_readonly': True
+        })
+
+def _dashboard_data(user_id, today):
+    # All aggregates read one consistent snapshot
+    _begin_read_only_snapshot()
     first_of_month = today.replace(day=1)
     
-    cash_account = Account.query.filter_by(user_id=current_user.id, code='1000').first()
-    cash_balance = cash_account.get_balance() if cash_account else Decimal('0')
-    
-    bank_accounts = Account.query.filter(
-        Account.user_id == current_user.id,
-        Account.code.in_(['1010', '1020', '1030'])
+    cash_and_bank_accounts = Account.query.filter(
+        Account.user_id == user_id,
+        Account.code.in_([CASH_ACCOUNT_CODE] + BANK_ACCOUNT_CODES)
     ).all()
-    bank_balance = sum(acc.get_balance() for acc in bank_accounts)
+    cash_and_bank_balances = Account.get_balances(cash_and_bank_accounts)
+    
+    cash_balance = Decimal('0')
+    bank_balance = Decimal('0')
+    for account in cash_and_bank_accounts:
+        if account.code == CASH_ACCOUNT_CODE:
+            cash_balance = cash_and_bank_balances[account.id]
+        else:
+            bank_balance += cash_and_bank_balances[account.id]
+    
+    # Asset balances per fund in one grouped query (assets are debit-normal)
+    fund_balances = dict(db.session.query(
+        Account.fund_type,
+        func.sum(func.coalesce(JournalEntry.debit_amount, 0) - func.coalesce(JournalEntry.credit_amount, 0))
+    ).join(JournalEntry, JournalEntry.account_id == Account.id).filter(
+        Account.user_id == user_id,
+        Account.account_type == AccountType.ASSET
+    ).group_by(Account.fund_type).all())
+    total_zakat = fund_balances.get(FundType.ZAKAT) or Decimal('0')
+    total_sadaqah = fund_balances.get(FundType.SADAQAH) or Decimal('0')
+    total_lillah = fund_balances.get(FundType.LILLAH) or Decimal('0')
+    total_amanah = fund_balances.get(FundType.AMANAH) or Decimal('0')
+    
+    chart_month_starts = _month_starts(first_of_month, CHART_MONTHS)
     
     # Personal/General Income (Excluding Zakat, Sadaqah, Fitrah, Fidyah, Kaffarah, Aqeeqah, Qurbani)
     # These represent Rent, Collections, and general donations
-    monthly_income = db.session.query(
-        func.coalesce(func.sum(Income.amount), 0)
+    income_year = extract('year', Income.date)
+    income_month = extract('month', Income.date)
+    income_by_month = db.session.query(
+        income_year,
+        income_month,
+        func.sum(Income.amount),
+        func.sum(case((Income.category.notin_(RESTRICTED_INCOME_CATEGORIES), Income.amount), else_=0))
     ).filter(
-        Income.user_id == current_user.id,
-        Income.date >= first_of_month,
+        Income.user_id == user_id,
+        Income.date >= chart_month_starts[0],
         Income.is_reversed == False,
-        Income.verification_status == VerificationStatus.VERIFIED,
-        Income.category.notin_([
-            IncomeCategory.ZAKAT, 
-            IncomeCategory.SADAQAH, 
-            IncomeCategory.FITRAH, 
-            IncomeCategory.FIDYAH, 
-            IncomeCategory.KAFFARAH, 
-            IncomeCategory.AQEEQAH, 
-            IncomeCategory.QURBANI
-        ])
-    ).scalar() or Decimal('0')
-    
-    monthly_expense = db.session.query(
-        func.coalesce(func.sum(Expense.amount), 0)
+        Income.verification_status == VerificationStatus.VERIFIED
+    ).group_by(income_year, income_month).all()
+    
+    expense_year = extract('year', Expense.date)
+    expense_month = extract('month', Expense.date)
+    expense_by_month = db.session.query(
+        expense_year,
+        expense_month,
+        func.sum(Expense.amount)
     ).filter(
-        Expense.user_id == current_user.id,
-        Expense.date >= first_of_month,
+        Expense.user_id == user_id,
+        Expense.date >= chart_month_starts[0],
         Expense.is_reversed == False,
         Expense.approval_status == ApprovalStatus.APPROVED
-    ).scalar() or Decimal('0')
+    ).group_by(expense_year, expense_month).all()
     
-    zakat_accounts = Account.query.filter(
-        Account.user_id == current_user.id,
-        Account.fund_type == FundType.ZAKAT,
-        Account.account_type == AccountType.ASSET
-    ).all()
-    total_zakat = sum(acc.get_balance() for acc in zakat_accounts)
+    this_month = (first_of_month.year, first_of_month.month)
+    income_totals = {}
+    monthly_income = Decimal('0')
+    for year, month, total, general_total in income_by_month:
+        key = (int(year), int(month))
+        income_totals[key] = total or Decimal('0')
+        if key >= this_month:
+            monthly_income += general_total or Decimal('0')
     
-    sadaqah_accounts = Account.query.filter(
-        Account.user_id == current_user.id,
-        Account.fund_type == FundType.SADAQAH,
-        Account.account_type == AccountType.ASSET
-    ).all()
-    total_sadaqah = sum(acc.get_balance() for acc in sadaqah_accounts)
+    expense_totals = {}
+    monthly_expense = Decimal('0')
+    for year, month, total in expense_by_month:
+        key = (int(year), int(month))
+        expense_totals[key] = total or Decimal('0')
+        if key >= this_month:
+            monthly_expense += total or Decimal('0')
     
-    lillah_accounts = Account.query.filter(
-        Account.user_id == current_user.id,
-        Account.fund_type == FundType.LILLAH,
-        Account.account_type == AccountType.ASSET
-    ).all()
-    total_lillah = sum(acc.get_balance() for acc in lillah_accounts)
+    months = [month_start.strftime('%b %Y') for month_start in chart_month_starts]
+    income_data = [float(income_totals.get((m.year, m.month), 0)) for m in chart_month_starts]
+    expense_data = [float(expense_totals.get((m.year, m.month), 0)) for m in chart_month_starts]
     
-    amanah_accounts = Account.query.filter(
-        Account.user_id == current_user.id,
-        Account.fund_type == FundType.AMANAH,
-        Account.account_type == AccountType.ASSET
-    ).all()
-    total_amanah = sum(acc.get_balance() for acc in amanah_accounts)
+    net_this_month = monthly_income - monthly_expense
+    
+    zakat_collected = Decimal('0')
+    zakat_distributed = Decimal('0')
+    alerts = []
+    
+    db.session.commit()
+    
+    return {
+        'cash_balance': cash_balance,
+        'bank_balance': bank_balance,
+        'monthly_income': monthly_income,
+        'monthly_expense': monthly_expense,
+        'total_zakat': total_zakat,
+        'total_sadaqah': total_sadaqah,
+        'total_lillah': total_lillah,
+        'total_amanah': total_amanah,
+        'net_this_month': net_this_month,
+        'chart_months': months,
+        'chart_income': income_data,
+        'chart_expense': expense_data,
+        'alerts': alerts
+    }
+
+def invalidate_dashboard_cache(user_id):
+    _dashboard_cache.pop(user_id, None)
+
+@dashboard_bp.route('/')
+@login_required
+def index():
+    today = datetime.utcnow().date()
+    cached = _dashboard_cache.get(current_user.id)
+    if cached and cached[0] == today and cached[1] > time.monotonic():
+        data = cached[2]
+    else:
+        data = _dashboard_data(current_user.id, today)
+        _dashboard_cache[current_user.id] = (today, time.monotonic() + DASHBOARD_CACHE_TTL, data)
     
-    recent_income = Income.query.filter_by(
+    # Only the columns the recent-activity tables render
+    recent_income = db.session.query(
+        Income.id, Income.receipt_number, Income.source, Income.amount, Income.verification_status
+    ).filter_by(
         user_id=current_user.id,
         is_reversed=False
     ).order_by(Income.created_at.desc()).limit(5).all()
     
-    recent_expenses = Expense.query.filter_by(
+    recent_expenses = db.session.query(
+        Expense.id, Expense.voucher_number, Expense.payee, Expense.amount, Expense.approval_status
+    ).filter_by(
         user_id=current_user.id,
         is_reversed=False
     ).order_by(Expense.created_at.desc()).limit(5).all()
     
-    months = []
-    income_data = []
-    expense_data = []
-    
-    for i in range(5, -1, -1):
-        target_date = today - timedelta(days=30 * i)
-        month_start = target_date.replace(day=1)
-        if target_date.month == 12:
-            month_end = month_start.replace(year=month_start.year + 1, month=1, day=1) - timedelta(days=1)
-        else:
-            month_end = month_start.replace(month=month_start.month + 1, day=1) - timedelta(days=1)
-        
-        months.append(month_start.strftime('%b %Y'))
-        
-        month_income = db.session.query(
-            func.coalesce(func.sum(Income.amount), 0)
-        ).filter(
-            Income.user_id == current_user.id,
-            Income.date >= month_start,
-            Income.date <= month_end,
-            Income.is_reversed == False,
-            Income.verification_status == VerificationStatus.VERIFIED
-        ).scalar() or Decimal('0')
-        income_data.append(float(month_income))
-        
-        month_expense = db.session.query(
-            func.coalesce(func.sum(Expense.amount), 0)
-        ).filter(
-            Expense.user_id == current_user.id,
-            Expense.date >= month_start,
-            Expense.date <= month_end,
-            Expense.is_reversed == False,
-            Expense.approval_status == ApprovalStatus.APPROVED
-        ).scalar() or Decimal('0')
-        expense_data.append(float(month_expense))
-    
-    net_this_month = monthly_income - monthly_expense
-    
-    zakat_collected = Decimal('0')
-    zakat_distributed = Decimal('0')
-    alerts = []
-    
     return render_template('dashboard/index.html',
-        cash_balance=cash_balance,
-        bank_balance=bank_balance,
-        monthly_income=monthly_income,
-        monthly_expense=monthly_expense,
-        total_zakat=total_zakat,
-        total_sadaqah=total_sadaqah,
-        total_lillah=total_lillah,
-        total_amanah=total_amanah,
-        net_this_month=net_this_month,
         recent_income=recent_income,
         recent_expenses=recent_expenses,
-        chart_months=months,
-        chart_income=income_data,
-        chart_expense=expense_data,
-        alerts=alerts
+        **data
     )
@@ -1,61 +1,127 @@
 import os
+import hashlib
+import tempfile
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, send_from_directory
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, send_from_directory, abort
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
-from models import (db, Expense, Transaction, JournalEntry, Account, AuditLog,
+from werkzeug.security import safe_join
+from werkzeug.exceptions import RequestEntityTooLarge
+from sqlalchemy.orm import joinedload
+from models import (db, Expense, Transaction, Account, AuditLog,
                    ExpenseCategory, PaymentMode, FundType, VerificationStatus,
-                   ApprovalStatus, PeriodLock)
+                   ApprovalStatus, PeriodLock, KeysetPage)
 from routes.auth import permission_required, read_only_check, log_action
+from routes.amounts import parse_amount
+from routes.dashboard import invalidate_dashboard_cache
+from routes.reports import invalidate_report_cache
 
 expenses_bp = Blueprint('expenses', __name__, url_prefix='/expenses')
 
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
+CATEGORY_ACCOUNT_CODES = {
+    ExpenseCategory.ZAKAT_DISBURSEMENT: '5000',
+    ExpenseCategory.SADAQAH_DISBURSEMENT: '5010',
+    ExpenseCategory.SALARIES: '5020',
+    ExpenseCategory.UTILITIES: '5030',
+    ExpenseCategory.MAINTENANCE: '5040',
+    ExpenseCategory.CONSTRUCTION: '5050',
+    ExpenseCategory.EDUCATION: '5060',
+    ExpenseCategory.EVENTS: '5070',
+    ExpenseCategory.FOOD: '5080',
+    ExpenseCategory.SUPPLIES: '5090',
+    ExpenseCategory.OTHER: '5100',
+    ExpenseCategory.POOR_NEEDY: '5010',
+    ExpenseCategory.FUNERAL: '5070',
+}
+
+CASH_ACCOUNT_CODE = '1000'
+
+UPLOAD_COPY_BUFFER_SIZE = 1024 * 1024
+
+ZERO = Decimal('0')
+
+FUND_BANK_ACCOUNT_CODES = {
+    FundType.ZAKAT: '1020',
+    FundType.SADAQAH: '1030',
+    FundType.AMANAH: '1040',
+    FundType.LILLAH: '1050',
+}
+
+CREATE_FORM_CONTEXT = {
+    'categories': ExpenseCategory.ALL_CATEGORIES,
+    'category_names': ExpenseCategory.CATEGORY_NAMES,
+    'funds': FundType.ALL_FUNDS,
+    'fund_names': FundType.FUND_NAMES,
+    'payment_modes': PaymentMode.ALL_MODES,
+    'payment_mode_names': PaymentMode.MODE_NAMES,
+}
+
+def _render_create_form():
+    return render_template('expenses/create.html', **CREATE_FORM_CONTEXT)
+
+# Upload settings, read once when the blueprint is registered
+_allowed_extensions = frozenset()
+_upload_folder = ''
+
+@expenses_bp.record_once
+def _load_upload_settings(state):
+    global _allowed_extensions, _upload_folder
+    _allowed_extensions = frozenset(extension.lower() for extension in state.app.config['ALLOWED_EXTENSIONS'])
+    _upload_folder = os.path.join(state.app.root_path, state.app.config['UPLOAD_FOLDER'])
+
+def upload_extension(filename):
+    """Lower-cased extension of an allowed upload filename, or None"""
+    _, dot, extension = filename.rpartition('.')
+    extension = extension.lower()
+    if dot and extension in _allowed_extensions:
+        return extension
+    return None
+
+def store_upload(stream, extension):
+    """Save an upload under a content hash, sharded as ab/cd/<hash>.<ext>; identical files share one path"""
+    digest = hashlib.blake2b(digest_size=32)
+    fd, temp_path = tempfile.mkstemp(dir=_upload_folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: stream.read(UPLOAD_COPY_BUFFER_SIZE), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        name = digest.hexdigest()
+        relative_path = f"{name[:2]}/{name[2:4]}/{name}.{extension}"
+        target_path = os.path.join(_upload_folder, name[:2], name[2:4], f"{name}.{extension}")
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        os.replace(temp_path, target_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return relative_path
+
+def discard_upload(relative_path):
+    """Delete a stored upload once the expense that would have used it is rolled back, unless another row shares it"""
+    if db.session.query(Expense.query.filter_by(supporting_document=relative_path).exists()).scalar():
+        return
+    try:
+        os.remove(os.path.join(_upload_folder, *relative_path.split('/')))
+    except FileNotFoundError:
+        pass
 
 def get_expense_accounts(user_id, category, payment_mode, fund_type):
-    category_to_account = {
-        ExpenseCategory.ZAKAT_DISBURSEMENT: '5000',
-        ExpenseCategory.SADAQAH_DISBURSEMENT: '5010',
-        ExpenseCategory.SALARIES: '5020',
-        ExpenseCategory.UTILITIES: '5030',
-        ExpenseCategory.MAINTENANCE: '5040',
-        ExpenseCategory.CONSTRUCTION: '5050',
-        ExpenseCategory.EDUCATION: '5060',
-        ExpenseCategory.EVENTS: '5070',
-        ExpenseCategory.FOOD: '5080',
-        ExpenseCategory.SUPPLIES: '5090',
-        ExpenseCategory.OTHER: '5100',
-        ExpenseCategory.POOR_NEEDY: '5010',
-        ExpenseCategory.FUNERAL: '5070',
-    }
-    expense_account = Account.query.filter_by(
-        user_id=user_id,
-        code=category_to_account.get(category, '5100')
-    ).first()
+    account_ids = Account.ids_by_code(user_id)
+    expense_account_id = account_ids.get(CATEGORY_ACCOUNT_CODES.get(category, '5100'))
     
     if payment_mode == PaymentMode.CASH:
-        asset_account = Account.query.filter_by(user_id=user_id, code='1000').first()
+        asset_account_id = account_ids.get(CASH_ACCOUNT_CODE)
     else:
-        if fund_type == FundType.ZAKAT:
-            asset_account = Account.query.filter_by(user_id=user_id, code='1020').first()
-        elif fund_type == FundType.SADAQAH:
-            asset_account = Account.query.filter_by(user_id=user_id, code='1030').first()
-        elif fund_type == FundType.AMANAH:
-            asset_account = Account.query.filter_by(user_id=user_id, code='1040').first()
-        elif fund_type == FundType.LILLAH:
-            asset_account = Account.query.filter_by(user_id=user_id, code='1050').first()
-        else:
-            asset_account = Account.query.filter_by(user_id=user_id, code='1010').first()
+        asset_account_id = account_ids.get(FUND_BANK_ACCOUNT_CODES.get(fund_type, '1010'))
     
-    return expense_account, asset_account
+    return expense_account_id, asset_account_id
 
 @expenses_bp.route('/')
 @login_required
 def index():
-    page = request.args.get('page', 1, type=int)
+    after = request.args.get('after')
+    before = request.args.get('before')
     status_filter = request.args.get('status', '')
     approval_filter = request.args.get('approval', '')
     category_filter = request.args.get('category', '')
@@ -72,12 +138,23 @@ def index():
     if fund_filter:
         query = query.filter_by(fund_type=fund_filter)
     
-    expenses = query.order_by(Expense.date.desc(), Expense.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
+    expenses = KeysetPage.fetch(
+        query, [Expense.date, Expense.created_at, Expense.id],
+        after=after, before=before, per_page=20
     )
     
+    filter_args = {
+        key: value for key, value in (
+            ('status', status_filter),
+            ('approval', approval_filter),
+            ('category', category_filter),
+            ('fund', fund_filter),
+        ) if value
+    }
+    
     return render_template('expenses/index.html',
         expenses=expenses,
+        filter_args=filter_args,
         categories=ExpenseCategory.ALL_CATEGORIES,
         category_names=ExpenseCategory.CATEGORY_NAMES,
         funds=FundType.ALL_FUNDS,
@@ -95,7 +172,10 @@ def index():
 @read_only_check
 @permission_required('create_expense')
 def create():
+    uid = current_user.id
+    
     if request.method == 'POST':
+        stored_document = None
         try:
             date_str = request.form.get('date', '')
             category = request.form.get('category', '')
@@ -108,51 +188,34 @@ def create():
             
             if not all([date_str, category, payee, description, amount_str, payment_mode]):
                 flash('Please fill in all required fields.', 'danger')
-                return render_template('expenses/create.html',
-                    categories=ExpenseCategory.ALL_CATEGORIES,
-                    category_names=ExpenseCategory.CATEGORY_NAMES,
-                    funds=FundType.ALL_FUNDS,
-                    fund_names=FundType.FUND_NAMES,
-                    payment_modes=PaymentMode.ALL_MODES,
-                    payment_mode_names=PaymentMode.MODE_NAMES
-                )
+                return _render_create_form()
+            
+            category_name = ExpenseCategory.CATEGORY_NAMES.get(category)
+            if category_name is None:
+                flash('Invalid expense category.', 'danger')
+                return _render_create_form()
             
             try:
                 date = datetime.strptime(date_str, '%Y-%m-%d').date()
             except ValueError:
                 flash('Invalid date format.', 'danger')
-                return render_template('expenses/create.html',
-                    categories=ExpenseCategory.ALL_CATEGORIES,
-                    category_names=ExpenseCategory.CATEGORY_NAMES,
-                    funds=FundType.ALL_FUNDS,
-                    fund_names=FundType.FUND_NAMES,
-                    payment_modes=PaymentMode.ALL_MODES,
-                    payment_mode_names=PaymentMode.MODE_NAMES
-                )
+                return _render_create_form()
             
-            if PeriodLock.is_period_locked(current_user.id, date):
+            if PeriodLock.is_period_locked(uid, date):
                 flash('Cannot create entry for a locked period.', 'danger')
                 return redirect(url_for('expenses.index'))
             
             try:
-                amount = Decimal(amount_str)
-                if amount <= 0:
-                    raise InvalidOperation()
+                amount = parse_amount(amount_str)
             except InvalidOperation:
                 flash('Invalid amount. Please enter a positive number.', 'danger')
-                return render_template('expenses/create.html',
-                    categories=ExpenseCategory.ALL_CATEGORIES,
-                    category_names=ExpenseCategory.CATEGORY_NAMES,
-                    funds=FundType.ALL_FUNDS,
-                    fund_names=FundType.FUND_NAMES,
-                    payment_modes=PaymentMode.ALL_MODES,
-                    payment_mode_names=PaymentMode.MODE_NAMES
-                )
+                return _render_create_form()
             
-            voucher_number = Expense.generate_voucher_number(current_user.id)
+            voucher_number = Expense.generate_voucher_number(uid)
+            now = datetime.utcnow()
             
             expense = Expense(
-                user_id=current_user.id,
+                user_id=uid,
                 voucher_number=voucher_number,
                 date=date,
                 category=category,
@@ -163,67 +226,49 @@ def create():
                 payment_mode=payment_mode,
                 payment_reference=payment_reference or None,
                 verification_status=VerificationStatus.VERIFIED,
-                verified_by_id=current_user.id,
-                verified_at=datetime.utcnow(),
+                verified_by_id=uid,
+                verified_at=now,
                 verification_remarks="Auto-verified on creation",
                 approval_status=ApprovalStatus.APPROVED,
-                approved_by_id=current_user.id,
-                approved_at=datetime.utcnow(),
+                approved_by_id=uid,
+                approved_at=now,
                 approval_remarks="Auto-approved on creation",
-                entered_by_id=current_user.id
+                entered_by_id=uid
             )
             
-            if 'supporting_document' in request.files:
-                file = request.files['supporting_document']
-                if file and file.filename and allowed_file(file.filename):
-                    filename = secure_filename(f"{voucher_number}_{file.filename}")
-                    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                    file.save(file_path)
-                    expense.supporting_document = filename
+            expense_account_id, asset_account_id = get_expense_accounts(uid, category, payment_mode, fund_type)
             
-            db.session.add(expense)
-            db.session.flush()
-            
-            expense_account, asset_account = get_expense_accounts(current_user.id, category, payment_mode, fund_type)
-            
-            if expense_account and asset_account:
-                transaction = Transaction(
-                    user_id=current_user.id,
-                    reference_number=f"TXN-{voucher_number}",
-                    transaction_type='expense',
-                    date=date,
-                    description=f"Expense: {payee} - {ExpenseCategory.CATEGORY_NAMES.get(category, category)}",
-                    fund_type=fund_type,
-                    total_amount=amount,
-                    created_by_id=current_user.id
-                )
-                db.session.add(transaction)
-                db.session.flush()
-                
-                debit_entry = JournalEntry(
-                    transaction_id=transaction.id,
-                    account_id=expense_account.id,
-                    debit_amount=amount,
-                    credit_amount=Decimal('0'),
-                    date=date,
-                    description=f"Voucher: {voucher_number}"
+            if expense_account_id and asset_account_id:
+                voucher_description = f"Voucher: {voucher_number}"
+                expense.transaction_id = Transaction.insert_posting(
+                    dict(
+                        user_id=uid,
+                        reference_number=f"TXN-{voucher_number}",
+                        transaction_type='expense',
+                        date=date,
+                        description=f"Expense: {payee} - {category_name}",
+                        fund_type=fund_type,
+                        total_amount=amount,
+                        created_by_id=uid
+                    ),
+                    [
+                        dict(account_id=expense_account_id, debit_amount=amount, credit_amount=ZERO,
+                             date=date, description=voucher_description),
+                        dict(account_id=asset_account_id, debit_amount=ZERO, credit_amount=amount,
+                             date=date, description=voucher_description),
+                    ]
                 )
-                
-                credit_entry = JournalEntry(
-                    transaction_id=transaction.id,
-                    account_id=asset_account.id,
-                    debit_amount=Decimal('0'),
-                    credit_amount=amount,
-                    date=date,
-                    description=f"Voucher: {voucher_number}"
-                )
-                
-                db.session.add(debit_entry)
-                db.session.add(credit_entry)
-                
-                expense.transaction_id = transaction.id
             
+            # Stored after the posting, so only a failed commit can leave the file unreferenced
+            file = request.files.get('supporting_document')
+            extension = upload_extension(file.filename) if file and file.filename else None
+            if extension:
+                stored_document = expense.supporting_document = store_upload(file.stream, extension)
+            
+            db.session.add(expense)
             db.session.commit()
+            invalidate_dashboard_cache(uid)
+            invalidate_report_cache(uid)
             
             log_action('create', 'expense', expense.id, None, {
                 'voucher_number': voucher_number,
@@ -234,23 +279,26 @@ def create():
             flash(f'Expense entry created successfully. Voucher: {voucher_number}', 'success')
             return redirect(url_for('expenses.view', id=expense.id))
             
+        except RequestEntityTooLarge:
+            db.session.rollback()
+            max_mb = current_app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+            flash(f'Upload is too large. Supporting documents must be under {max_mb} MB.', 'danger')
         except Exception as e:
             db.session.rollback()
+            if stored_document:
+                discard_upload(stored_document)
             flash(f'Error creating expense entry: {str(e)}', 'danger')
     
-    return render_template('expenses/create.html',
-        categories=ExpenseCategory.ALL_CATEGORIES,
-        category_names=ExpenseCategory.CATEGORY_NAMES,
-        funds=FundType.ALL_FUNDS,
-        fund_names=FundType.FUND_NAMES,
-        payment_modes=PaymentMode.ALL_MODES,
-        payment_mode_names=PaymentMode.MODE_NAMES
-    )
+    return _render_create_form()
 
 @expenses_bp.route('/<int:id>')
 @login_required
 def view(id):
-    expense = Expense.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    expense = Expense.query.options(
+        joinedload(Expense.entered_by),
+        joinedload(Expense.verified_by),
+        joinedload(Expense.approved_by)
+    ).filter_by(id=id, user_id=current_user.id).first_or_404()
     return render_template('expenses/view.html',
         expense=expense,
         category_names=ExpenseCategory.CATEGORY_NAMES,
@@ -258,23 +306,38 @@ def view(id):
         payment_mode_names=PaymentMode.MODE_NAMES
     )
 
-@expenses_bp.route('/uploads/<filename>')
+@expenses_bp.route('/uploads/<path:filename>')
 @login_required
 def download_file(filename):
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    owns_file = db.session.query(
+        Expense.query.filter_by(user_id=current_user.id, supporting_document=filename).exists()
+    ).scalar()
+    if not owns_file:
+        abort(404)
+    
+    accel_prefix = current_app.config.get('UPLOAD_ACCEL_REDIRECT_PREFIX')
+    if accel_prefix:
+        path = safe_join(_upload_folder, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = current_app.response_class()
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{filename}"
+        return response
+    return send_from_directory(_upload_folder, filename)
 
 @expenses_bp.route('/<int:id>/reverse', methods=['POST'])
 @login_required
 @read_only_check
 @permission_required('create_expense')
 def reverse(id):
-    expense = Expense.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    uid = current_user.id
+    expense = Expense.query.filter_by(id=id, user_id=uid).first_or_404()
     
     if expense.is_reversed:
         flash('This expense entry has already been reversed.', 'warning')
         return redirect(url_for('expenses.view', id=id))
     
-    if PeriodLock.is_period_locked(current_user.id, expense.date):
+    if PeriodLock.is_period_locked(uid, expense.date):
         flash('Cannot reverse entry in a locked period.', 'danger')
         return redirect(url_for('expenses.view', id=id))
     
@@ -283,10 +346,13 @@ def reverse(id):
         flash('Reversal remarks are required.', 'danger')
         return redirect(url_for('expenses.view', id=id))
     
+    now = datetime.utcnow()
+    today = now.date()
+    
     reversal = Expense(
-        user_id=current_user.id,
+        user_id=uid,
         voucher_number=f"REV-{expense.voucher_number}",
-        date=datetime.utcnow().date(),
+        date=today,
         category=expense.category,
         fund_type=expense.fund_type,
         payee=f"Reversal of {expense.voucher_number}",
@@ -294,65 +360,54 @@ def reverse(id):
         amount=-expense.amount,
         payment_mode=expense.payment_mode,
         verification_status=VerificationStatus.VERIFIED,
-        verified_by_id=current_user.id,
-        verified_at=datetime.utcnow(),
+        verified_by_id=uid,
+        verified_at=now,
         verification_remarks=f"Auto-verified reversal",
         approval_status=ApprovalStatus.APPROVED,
-        approved_by_id=current_user.id,
-        approved_at=datetime.utcnow(),
+        approved_by_id=uid,
+        approved_at=now,
         approval_remarks=f"Auto-approved reversal: {remarks}",
-        entered_by_id=current_user.id,
+        entered_by_id=uid,
         reversal_of_id=expense.id
     )
     
     expense.is_reversed = True
     
     if expense.transaction_id:
-        expense_account, asset_account = get_expense_accounts(
-            current_user.id, expense.category, expense.payment_mode, expense.fund_type
+        expense_account_id, asset_account_id = get_expense_accounts(
+            uid, expense.category, expense.payment_mode, expense.fund_type
         )
         
-        if expense_account and asset_account:
-            rev_transaction = Transaction(
-                user_id=current_user.id,
-                reference_number=f"TXN-REV-{expense.voucher_number}",
-                transaction_type='expense_reversal',
-                date=datetime.utcnow().date(),
-                description=f"Reversal of Expense: {expense.voucher_number}",
-                fund_type=expense.fund_type,
-                total_amount=expense.amount,
-                created_by_id=current_user.id,
-                reversal_of_id=expense.transaction_id
+        if expense_account_id and asset_account_id:
+            Transaction.query.filter_by(id=expense.transaction_id).update(
+                {Transaction.is_reversed: True}, synchronize_session=False
             )
-            db.session.add(rev_transaction)
-            db.session.flush()
             
-            debit_entry = JournalEntry(
-                transaction_id=rev_transaction.id,
-                account_id=asset_account.id,
-                debit_amount=expense.amount,
-                credit_amount=Decimal('0'),
-                date=datetime.utcnow().date(),
-                description=f"Reversal of Voucher: {expense.voucher_number}"
+            reversal_description = f"Reversal of Voucher: {expense.voucher_number}"
+            reversal.transaction_id = Transaction.insert_posting(
+                dict(
+                    user_id=uid,
+                    reference_number=f"TXN-REV-{expense.voucher_number}",
+                    transaction_type='expense_reversal',
+                    date=today,
+                    description=f"Reversal of Expense: {expense.voucher_number}",
+                    fund_type=expense.fund_type,
+                    total_amount=expense.amount,
+                    created_by_id=uid,
+                    reversal_of_id=expense.transaction_id
+                ),
+                [
+                    dict(account_id=asset_account_id, debit_amount=expense.amount, credit_amount=ZERO,
+                         date=today, description=reversal_description),
+                    dict(account_id=expense_account_id, debit_amount=ZERO, credit_amount=expense.amount,
+                         date=today, description=reversal_description),
+                ]
             )
-            
-            credit_entry = JournalEntry(
-                transaction_id=rev_transaction.id,
-                account_id=expense_account.id,
-                debit_amount=Decimal('0'),
-                credit_amount=expense.amount,
-                date=datetime.utcnow().date(),
-                description=f"Reversal of Voucher: {expense.voucher_number}"
-            )
-            
-            db.session.add(debit_entry)
-            db.session.add(credit_entry)
-            reversal.transaction_id = rev_transaction.id
-            
-            expense.transaction.is_reversed = True
     
     db.session.add(reversal)
     db.session.commit()
+    invalidate_dashboard_cache(uid)
+    invalidate_report_cache(uid)
     
     log_action('reverse', 'expense', expense.id, None, {'reversal_id': reversal.id, 'remarks': remarks})
     
@@ -1,58 +1,76 @@
-from datetime import datetime
+from datetime import datetime, date as date_type, time as time_type
 from decimal import Decimal, InvalidOperation
 import json
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
-from models import (db, Income, Transaction, JournalEntry, Account, AuditLog,
+from sqlalchemy.orm import joinedload, raiseload
+from models import (db, Income, Transaction, Account, AuditLog,
                    IncomeCategory, PaymentMode, FundType, VerificationStatus,
-                   PeriodLock)
+                   PeriodLock, KeysetPage)
 from routes.auth import permission_required, read_only_check, log_action
+from routes.amounts import parse_amount
+from routes.dashboard import invalidate_dashboard_cache
+from routes.reports import invalidate_report_cache
 
 income_bp = Blueprint('income', __name__, url_prefix='/income')
 
+CATEGORY_ACCOUNT_CODES = {
+    IncomeCategory.ZAKAT: '4000',
+    IncomeCategory.SADAQAH: '4010',
+    IncomeCategory.FITRAH: '4020',
+    IncomeCategory.LILLAH: '4030',
+    IncomeCategory.DONATION: '4040',
+    IncomeCategory.RENTAL: '4050',
+    IncomeCategory.SPECIAL: '4060',
+    IncomeCategory.AMANAH: '4070',
+    IncomeCategory.OTHER: '4080',
+    IncomeCategory.FIDYAH: '4010',
+    IncomeCategory.KAFFARAH: '4010',
+    IncomeCategory.AQEEQAH: '4010',
+    IncomeCategory.QURBANI: '4010',
+}
+
+CASH_ACCOUNT_CODE = '1000'
+
+FUND_MAPPING = IncomeCategory.FUND_MAPPING
+CATEGORY_NAMES = IncomeCategory.CATEGORY_NAMES
+
+ZERO = Decimal('0')
+
+FUND_BANK_ACCOUNT_CODES = {
+    FundType.ZAKAT: '1020',
+    FundType.SADAQAH: '1030',
+    FundType.AMANAH: '1040',
+    FundType.LILLAH: '1050',
+}
+
+CREATE_FORM_CONTEXT = {
+    'categories': IncomeCategory.ALL_CATEGORIES,
+    'category_names': CATEGORY_NAMES,
+    'payment_modes': PaymentMode.ALL_MODES,
+    'payment_mode_names': PaymentMode.MODE_NAMES,
+}
+
+def _render_create_form():
+    return render_template('income/create.html', **CREATE_FORM_CONTEXT)
+
 def get_income_accounts(user_id, category, payment_mode):
-    fund_type = IncomeCategory.FUND_MAPPING.get(category, FundType.GENERAL)
-    
-    category_to_account = {
-        IncomeCategory.ZAKAT: '4000',
-        IncomeCategory.SADAQAH: '4010',
-        IncomeCategory.FITRAH: '4020',
-        IncomeCategory.LILLAH: '4030',
-        IncomeCategory.DONATION: '4040',
-        IncomeCategory.RENTAL: '4050',
-        IncomeCategory.SPECIAL: '4060',
-        IncomeCategory.AMANAH: '4070',
-        IncomeCategory.OTHER: '4080',
-        IncomeCategory.FIDYAH: '4010',
-        IncomeCategory.KAFFARAH: '4010',
-        IncomeCategory.AQEEQAH: '4010',
-        IncomeCategory.QURBANI: '4010',
-    }
-    income_account = Account.query.filter_by(
-        user_id=user_id,
-        code=category_to_account.get(category, '4080')
-    ).first()
+    fund_type = FUND_MAPPING.get(category, FundType.GENERAL)
     
+    income_code = CATEGORY_ACCOUNT_CODES.get(category, '4080')
     if payment_mode == PaymentMode.CASH:
-        asset_account = Account.query.filter_by(user_id=user_id, code='1000').first()
+        asset_code = CASH_ACCOUNT_CODE
     else:
-        if fund_type == FundType.ZAKAT:
-            asset_account = Account.query.filter_by(user_id=user_id, code='1020').first()
-        elif fund_type == FundType.SADAQAH:
-            asset_account = Account.query.filter_by(user_id=user_id, code='1030').first()
-        elif fund_type == FundType.AMANAH:
-            asset_account = Account.query.filter_by(user_id=user_id, code='1040').first()
-        elif fund_type == FundType.LILLAH:
-            asset_account = Account.query.filter_by(user_id=user_id, code='1050').first()
-        else:
-            asset_account = Account.query.filter_by(user_id=user_id, code='1010').first()
+        asset_code = FUND_BANK_ACCOUNT_CODES.get(fund_type, '1010')
     
-    return income_account, asset_account
+    account_ids = Account.ids_by_code(user_id)
+    return account_ids.get(income_code), account_ids.get(asset_code)
 
 @income_bp.route('/')
 @login_required
 def index():
-    page = request.args.get('page', 1, type=int)
+    after = request.args.get('after')
+    before = request.args.get('before')
     status_filter = request.args.get('status', '')
     category_filter = request.args.get('category', '')
     fund_filter = request.args.get('fund', '')
@@ -66,14 +84,28 @@ def index():
     if fund_filter:
         query = query.filter_by(fund_type=fund_filter)
     
-    incomes = query.order_by(Income.date.desc(), Income.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
+    incomes = KeysetPage.fetch(
+        query, [Income.date, Income.created_at, Income.id],
+        after=after, before=before, per_page=20
     )
     
+    # Category labels resolved here so the row loop does no dict lookups in Jinja
+    income_rows = [(income, CATEGORY_NAMES.get(income.category, income.category)) for income in incomes.items]
+    
+    filter_args = {
+        key: value for key, value in (
+            ('status', status_filter),
+            ('category', category_filter),
+            ('fund', fund_filter),
+        ) if value
+    }
+    
     return render_template('income/index.html',
         incomes=incomes,
+        income_rows=income_rows,
+        filter_args=filter_args,
         categories=IncomeCategory.ALL_CATEGORIES,
-        category_names=IncomeCategory.CATEGORY_NAMES,
+        category_names=CATEGORY_NAMES,
         funds=FundType.ALL_FUNDS,
         fund_names=FundType.FUND_NAMES,
         statuses=VerificationStatus.ALL_STATUSES,
@@ -89,56 +121,41 @@ def index():
 def create():
     if request.method == 'POST':
         try:
-            date_str = request.form.get('date', '')
-            time_str = request.form.get('time', '')
-            category = request.form.get('category', '')
-            source = request.form.get('source', '').strip()
-            payer_name = request.form.get('payer_name', '').strip()
-            payer_contact = request.form.get('payer_contact', '').strip()
-            payment_mode = request.form.get('payment_mode', '')
-            payment_reference = request.form.get('payment_reference', '').strip()
-            amount_str = request.form.get('amount', '')
-            description = request.form.get('description', '').strip()
+            form = request.form
+            date_str = form.get('date', '')
+            time_str = form.get('time', '')
+            category = form.get('category', '')
+            source = form.get('source', '').strip()
+            payer_name = form.get('payer_name', '').strip()
+            payer_contact = form.get('payer_contact', '').strip()
+            payment_mode = form.get('payment_mode', '')
+            payment_reference = form.get('payment_reference', '').strip()
+            amount_str = form.get('amount', '')
+            description = form.get('description', '').strip()
             
-            if not all([date_str, time_str, category, source, payment_mode, amount_str]):
+            if not (date_str and time_str and category and source and payment_mode and amount_str):
                 flash('Please fill in all required fields.', 'danger')
-                return render_template('income/create.html',
-                    categories=IncomeCategory.ALL_CATEGORIES,
-                    category_names=IncomeCategory.CATEGORY_NAMES,
-                    payment_modes=PaymentMode.ALL_MODES,
-                    payment_mode_names=PaymentMode.MODE_NAMES
-                )
+                return _render_create_form()
             
             try:
-                date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                time = datetime.strptime(time_str, '%H:%M').time()
+                date = date_type.fromisoformat(date_str)
+                hours, _, minutes = time_str.partition(':')
+                time = time_type(int(hours), int(minutes))
             except ValueError:
                 flash('Invalid date or time format.', 'danger')
-                return render_template('income/create.html',
-                    categories=IncomeCategory.ALL_CATEGORIES,
-                    category_names=IncomeCategory.CATEGORY_NAMES,
-                    payment_modes=PaymentMode.ALL_MODES,
-                    payment_mode_names=PaymentMode.MODE_NAMES
-                )
+                return _render_create_form()
             
             if PeriodLock.is_period_locked(current_user.id, date):
                 flash('Cannot create entry for a locked period.', 'danger')
                 return redirect(url_for('income.index'))
             
             try:
-                amount = Decimal(amount_str)
-                if amount <= 0:
-                    raise InvalidOperation()
+                amount = parse_amount(amount_str)
             except InvalidOperation:
                 flash('Invalid amount. Please enter a positive number.', 'danger')
-                return render_template('income/create.html',
-                    categories=IncomeCategory.ALL_CATEGORIES,
-                    category_names=IncomeCategory.CATEGORY_NAMES,
-                    payment_modes=PaymentMode.ALL_MODES,
-                    payment_mode_names=PaymentMode.MODE_NAMES
-                )
+                return _render_create_form()
             
-            fund_type = IncomeCategory.FUND_MAPPING.get(category, FundType.GENERAL)
+            fund_type = FUND_MAPPING.get(category, FundType.GENERAL)
             receipt_number = Income.generate_receipt_number(current_user.id)
             
             income = Income(
@@ -162,49 +179,33 @@ def create():
                 entered_by_id=current_user.id
             )
             
-            db.session.add(income)
-            db.session.flush()
-            
-            income_account, asset_account = get_income_accounts(current_user.id, category, payment_mode)
+            income_account_id, asset_account_id = get_income_accounts(current_user.id, category, payment_mode)
             
-            if income_account and asset_account:
-                transaction = Transaction(
-                    user_id=current_user.id,
-                    reference_number=f"TXN-{receipt_number}",
-                    transaction_type='income',
-                    date=date,
-                    description=f"Income: {source} - {IncomeCategory.CATEGORY_NAMES.get(category, category)}",
-                    fund_type=fund_type,
-                    total_amount=amount,
-                    created_by_id=current_user.id
-                )
-                db.session.add(transaction)
-                db.session.flush()
-                
-                debit_entry = JournalEntry(
-                    transaction_id=transaction.id,
-                    account_id=asset_account.id,
-                    debit_amount=amount,
-                    credit_amount=Decimal('0'),
-                    date=date,
-                    description=f"Receipt: {receipt_number}"
+            if income_account_id and asset_account_id:
+                receipt_description = f"Receipt: {receipt_number}"
+                income.transaction_id = Transaction.insert_posting(
+                    dict(
+                        user_id=current_user.id,
+                        reference_number=f"TXN-{receipt_number}",
+                        transaction_type='income',
+                        date=date,
+                        description=f"Income: {source} - {CATEGORY_NAMES.get(category, category)}",
+                        fund_type=fund_type,
+                        total_amount=amount,
+                        created_by_id=current_user.id
+                    ),
+                    [
+                        dict(account_id=asset_account_id, debit_amount=amount, credit_amount=ZERO,
+                             date=date, description=receipt_description),
+                        dict(account_id=income_account_id, debit_amount=ZERO, credit_amount=amount,
+                             date=date, description=receipt_description),
+                    ]
                 )
-                
-                credit_entry = JournalEntry(
-                    transaction_id=transaction.id,
-                    account_id=income_account.id,
-                    debit_amount=Decimal('0'),
-                    credit_amount=amount,
-                    date=date,
-                    description=f"Receipt: {receipt_number}"
-                )
-                
-                db.session.add(debit_entry)
-                db.session.add(credit_entry)
-                
-                income.transaction_id = transaction.id
             
+            db.session.add(income)
             db.session.commit()
+            invalidate_dashboard_cache(current_user.id)
+            invalidate_report_cache(current_user.id)
             
             log_action('create', 'income', income.id, None, {
                 'receipt_number': receipt_number,
@@ -219,20 +220,20 @@ def create():
             db.session.rollback()
             flash(f'Error creating income entry: {str(e)}', 'danger')
     
-    return render_template('income/create.html',
-        categories=IncomeCategory.ALL_CATEGORIES,
-        category_names=IncomeCategory.CATEGORY_NAMES,
-        payment_modes=PaymentMode.ALL_MODES,
-        payment_mode_names=PaymentMode.MODE_NAMES
-    )
+    return _render_create_form()
 
 @income_bp.route('/<int:id>')
 @login_required
 def view(id):
-    income = Income.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    options = [joinedload(Income.entered_by), joinedload(Income.verified_by)]
+    if current_app.testing or current_app.config['RAISE_ON_LAZY_LOAD']:
+        # Surface any relationship the template uses without an eager load in tests
+        options.append(raiseload('*'))
+    
+    income = Income.query.options(*options).filter_by(id=id, user_id=current_user.id).first_or_404()
     return render_template('income/view.html',
         income=income,
-        category_names=IncomeCategory.CATEGORY_NAMES,
+        category_names=CATEGORY_NAMES,
         fund_names=FundType.FUND_NAMES,
         payment_mode_names=PaymentMode.MODE_NAMES
     )
@@ -257,11 +258,14 @@ def reverse(id):
         flash('Reversal remarks are required.', 'danger')
         return redirect(url_for('income.view', id=id))
     
+    now = datetime.utcnow()
+    today = now.date()
+    
     reversal = Income(
         user_id=current_user.id,
         receipt_number=f"REV-{income.receipt_number}",
-        date=datetime.utcnow().date(),
-        time=datetime.utcnow().time(),
+        date=today,
+        time=now.time(),
         category=income.category,
         fund_type=income.fund_type,
         source=f"Reversal of {income.receipt_number}",
@@ -271,7 +275,7 @@ def reverse(id):
         description=f"Reversal: {remarks}",
         verification_status=VerificationStatus.VERIFIED,
         verified_by_id=current_user.id,
-        verified_at=datetime.utcnow(),
+        verified_at=now,
         verification_remarks=f"Auto-verified reversal: {remarks}",
         entered_by_id=current_user.id,
         reversal_of_id=income.id
@@ -280,49 +284,38 @@ def reverse(id):
     income.is_reversed = True
     
     if income.transaction_id:
-        income_account, asset_account = get_income_accounts(current_user.id, income.category, income.payment_mode)
+        income_account_id, asset_account_id = get_income_accounts(current_user.id, income.category, income.payment_mode)
         
-        if income_account and asset_account:
-            rev_transaction = Transaction(
-                user_id=current_user.id,
-                reference_number=f"TXN-REV-{income.receipt_number}",
-                transaction_type='income_reversal',
-                date=datetime.utcnow().date(),
-                description=f"Reversal of Income: {income.receipt_number}",
-                fund_type=income.fund_type,
-                total_amount=income.amount,
-                created_by_id=current_user.id,
-                reversal_of_id=income.transaction_id
-            )
-            db.session.add(rev_transaction)
-            db.session.flush()
-            
-            debit_entry = JournalEntry(
-                transaction_id=rev_transaction.id,
-                account_id=income_account.id,
-                debit_amount=income.amount,
-                credit_amount=Decimal('0'),
-                date=datetime.utcnow().date(),
-                description=f"Reversal of Receipt: {income.receipt_number}"
+        if income_account_id and asset_account_id:
+            Transaction.query.filter_by(id=income.transaction_id).update(
+                {Transaction.is_reversed: True}, synchronize_session=False
             )
             
-            credit_entry = JournalEntry(
-                transaction_id=rev_transaction.id,
-                account_id=asset_account.id,
-                debit_amount=Decimal('0'),
-                credit_amount=income.amount,
-                date=datetime.utcnow().date(),
-                description=f"Reversal of Receipt: {income.receipt_number}"
+            reversal_description = f"Reversal of Receipt: {income.receipt_number}"
+            reversal.transaction_id = Transaction.insert_posting(
+                dict(
+                    user_id=current_user.id,
+                    reference_number=f"TXN-REV-{income.receipt_number}",
+                    transaction_type='income_reversal',
+                    date=today,
+                    description=f"Reversal of Income: {income.receipt_number}",
+                    fund_type=income.fund_type,
+                    total_amount=income.amount,
+                    created_by_id=current_user.id,
+                    reversal_of_id=income.transaction_id
+                ),
+                [
+                    dict(account_id=income_account_id, debit_amount=income.amount, credit_amount=ZERO,
+                         date=today, description=reversal_description),
+                    dict(account_id=asset_account_id, debit_amount=ZERO, credit_amount=income.amount,
+                         date=today, description=reversal_description),
+                ]
             )
-            
-            db.session.add(debit_entry)
-            db.session.add(credit_entry)
-            reversal.transaction_id = rev_transaction.id
-            
-            income.transaction.is_reversed = True
     
     db.session.add(reversal)
     db.session.commit()
+    invalidate_dashboard_cache(current_user.id)
+    invalidate_report_cache(current_user.id)
     
     log_action('reverse', 'income', income.id, None, {'reversal_id': reversal.id, 'remarks': remarks})
     
@@ -1,20 +1,105 @@
 import io
 import csv
-from datetime import datetime
+import time
+from datetime import datetime, date
 from decimal import Decimal
-from flask import Blueprint, render_template, request, make_response, send_file
+from flask import Blueprint, Response, render_template, request, send_file, stream_with_context
 from flask_login import login_required, current_user
-from sqlalchemy import func
+from sqlalchemy import func, case
+from sqlalchemy.orm import load_only
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from models import (db, Income, Expense, Account, AccountType, FundType,
+from reportlab.pdfgen import canvas
+from models import (db, Income, Expense, Account, JournalEntry, AccountType, FundType,
                    IncomeCategory, ExpenseCategory, VerificationStatus, ApprovalStatus)
 
 reports_bp = Blueprint('reports', __name__, url_prefix='/reports')
 
+# The daily report lists income and expenses together, so it labels both category sets
+DAILY_CATEGORY_NAMES = {**IncomeCategory.CATEGORY_NAMES, **ExpenseCategory.CATEGORY_NAMES}
+
+# The trial balance PDF is drawn directly on a canvas: fixed columns, one ruled row per account
+PDF_MARGIN = 30
+TRIAL_BALANCE_ROW_HEIGHT = 18
+TRIAL_BALANCE_COLUMNS = [(80, 'Account Code'), (250, 'Account Name'), (100, 'Debit'), (100, 'Credit')]
+TRIAL_BALANCE_LEFT = (A4[0] - sum(width for width, _ in TRIAL_BALANCE_COLUMNS)) / 2
+
+def _draw_trial_balance_row(pdf, y, cells, header=False, total=False):
+    if header or total:
+        pdf.setFillColor(colors.grey if header else colors.lightgrey)
+    pdf.setStrokeColor(colors.black)
+    pdf.setLineWidth(1)
+    
+    x = TRIAL_BALANCE_LEFT
+    for (width, _), cell in zip(TRIAL_BALANCE_COLUMNS, cells):
+        pdf.rect(x, y, width, TRIAL_BALANCE_ROW_HEIGHT, stroke=1, fill=1 if header or total else 0)
+        x += width
+    
+    pdf.setFillColor(colors.whitesmoke if header else colors.black)
+    pdf.setFont('Helvetica-Bold' if header or total else 'Helvetica', 10)
+    x = TRIAL_BALANCE_LEFT
+    for index, ((width, _), cell) in enumerate(zip(TRIAL_BALANCE_COLUMNS, cells)):
+        if index == 1 and not header:
+            pdf.drawString(x + 6, y + 5, cell)
+        else:
+            pdf.drawCentredString(x + width / 2, y + 5, cell)
+        x += width
+
+def _next_trial_balance_row(pdf, y):
+    """The y of the next row, starting a new page under a repeated header when this one is full"""
+    y -= TRIAL_BALANCE_ROW_HEIGHT
+    if y < PDF_MARGIN:
+        pdf.showPage()
+        y = A4[1] - PDF_MARGIN - TRIAL_BALANCE_ROW_HEIGHT
+        _draw_trial_balance_row(pdf, y, [title for _, title in TRIAL_BALANCE_COLUMNS], header=True)
+        y -= TRIAL_BALANCE_ROW_HEIGHT
+    return y
+
+def parse_date(value):
+    """A YYYY-MM-DD query argument as a date, or None when it is blank or malformed"""
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+# Report aggregates are cached per user for this many seconds; writes invalidate them
+REPORT_CACHE_TTL = 300
+
+_report_cache = {}
+
+def cached_report(user_id, key, build):
+    user_cache = _report_cache.setdefault(user_id, {})
+    cached = user_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    data = build()
+    user_cache[key] = (time.monotonic() + REPORT_CACHE_TTL, data)
+    return data
+
+def invalidate_report_cache(user_id):
+    _report_cache.pop(user_id, None)
+
+# CSV exports are streamed: rows are fetched from the database and written out in batches
+CSV_QUERY_BATCH_SIZE = 1000
+CSV_FLUSH_ROWS = 500
+
+def csv_response(header, rows, filename):
+    def generate():
+        output = io.StringIO()
+        writerow = csv.writer(output).writerow
+        writerow(header)
+        for count, row in enumerate(rows, 1):
+            writerow(row)
+            if count % CSV_FLUSH_ROWS == 0:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue()
+    
+    response = Response(stream_with_context(generate()), content_type='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
 @reports_bp.route('/')
 @login_required
 def index():
@@ -23,27 +108,39 @@ def index():
 @reports_bp.route('/daily')
 @login_required
 def daily():
-    date_str = request.args.get('date', datetime.utcnow().strftime('%Y-%m-%d'))
+    report_date = parse_date(request.args.get('date', '')) or datetime.utcnow().date()
     
-    try:
-        report_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-    except ValueError:
-        report_date = datetime.utcnow().date()
-    
-    incomes = Income.query.filter(
+    incomes = Income.query.options(
+        load_only(Income.id, Income.receipt_number, Income.category, Income.source, Income.amount)
+    ).filter(
         Income.user_id == current_user.id,
         Income.date == report_date,
         Income.is_reversed == False
     ).order_by(Income.created_at).all()
     
-    expenses = Expense.query.filter(
+    expenses = Expense.query.options(
+        load_only(Expense.id, Expense.voucher_number, Expense.category, Expense.payee, Expense.amount)
+    ).filter(
         Expense.user_id == current_user.id,
         Expense.date == report_date,
         Expense.is_reversed == False
     ).order_by(Expense.created_at).all()
     
-    total_income = sum(i.amount for i in incomes if i.verification_status == VerificationStatus.VERIFIED)
-    total_expense = sum(e.amount for e in expenses if e.approval_status == ApprovalStatus.APPROVED)
+    # Both totals come back from a single SELECT of two scalar subqueries
+    total_income, total_expense = db.session.query(
+        db.session.query(func.coalesce(func.sum(Income.amount), 0)).filter(
+            Income.user_id == current_user.id,
+            Income.date == report_date,
+            Income.is_reversed == False,
+            Income.verification_status == VerificationStatus.VERIFIED
+        ).scalar_subquery(),
+        db.session.query(func.coalesce(func.sum(Expense.amount), 0)).filter(
+            Expense.user_id == current_user.id,
+            Expense.date == report_date,
+            Expense.is_reversed == False,
+            Expense.approval_status == ApprovalStatus.APPROVED
+        ).scalar_subquery()
+    ).one()
     
     return render_template('reports/daily.html',
         report_date=report_date,
@@ -51,26 +148,15 @@ def daily():
         expenses=expenses,
         total_income=total_income,
         total_expense=total_expense,
-        category_names={**IncomeCategory.CATEGORY_NAMES, **ExpenseCategory.CATEGORY_NAMES}
+        category_names=DAILY_CATEGORY_NAMES
     )
 
-@reports_bp.route('/monthly')
-@login_required
-def monthly():
-    year = request.args.get('year', datetime.utcnow().year, type=int)
-    month = request.args.get('month', datetime.utcnow().month, type=int)
-    
-    start_date = datetime(year, month, 1).date()
-    if month == 12:
-        end_date = datetime(year + 1, 1, 1).date()
-    else:
-        end_date = datetime(year, month + 1, 1).date()
-    
+def _monthly_data(user_id, start_date, end_date):
     income_by_category = db.session.query(
         Income.category,
         func.sum(Income.amount).label('total')
     ).filter(
-        Income.user_id == current_user.id,
+        Income.user_id == user_id,
         Income.date >= start_date,
         Income.date < end_date,
         Income.is_reversed == False,
@@ -81,13 +167,32 @@ def monthly():
         Expense.category,
         func.sum(Expense.amount).label('total')
     ).filter(
-        Expense.user_id == current_user.id,
+        Expense.user_id == user_id,
         Expense.date >= start_date,
         Expense.date < end_date,
         Expense.is_reversed == False,
         Expense.approval_status == ApprovalStatus.APPROVED
     ).group_by(Expense.category).all()
     
+    return income_by_category, expense_by_category
+
+@reports_bp.route('/monthly')
+@login_required
+def monthly():
+    year = request.args.get('year', datetime.utcnow().year, type=int)
+    month = request.args.get('month', datetime.utcnow().month, type=int)
+    
+    start_date = datetime(year, month, 1).date()
+    if month == 12:
+        end_date = datetime(year + 1, 1, 1).date()
+    else:
+        end_date = datetime(year, month + 1, 1).date()
+    
+    income_by_category, expense_by_category = cached_report(
+        current_user.id, ('monthly', start_date),
+        lambda: _monthly_data(current_user.id, start_date, end_date)
+    )
+    
     total_income = sum(i.total or 0 for i in income_by_category)
     total_expense = sum(e.total or 0 for e in expense_by_category)
     
@@ -109,55 +214,27 @@ def payer():
     start_date = request.args.get('start_date', '')
     end_date = request.args.get('end_date', '')
     
-    query = Income.query.filter(
+    filters = [
         Income.user_id == current_user.id,
         Income.is_reversed == False,
         Income.verification_status == VerificationStatus.VERIFIED,
         Income.payer_name.isnot(None),
         Income.payer_name != ''
-    )
+    ]
     
-    if start_date:
-        try:
-            start = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(Income.date >= start)
-        except ValueError:
-            pass
+    start = parse_date(start_date)
+    if start:
+        filters.append(Income.date >= start)
     
-    if end_date:
-        try:
-            end = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(Income.date <= end)
-        except ValueError:
-            pass
+    end = parse_date(end_date)
+    if end:
+        filters.append(Income.date <= end)
     
     payer_totals = db.session.query(
         Income.payer_name,
         func.count(Income.id).label('count'),
         func.sum(Income.amount).label('total')
-    ).filter(
-        Income.user_id == current_user.id,
-        Income.is_reversed == False,
-        Income.verification_status == VerificationStatus.VERIFIED,
-        Income.payer_name.isnot(None),
-        Income.payer_name != ''
-    )
-    
-    if start_date:
-        try:
-            start = datetime.strptime(start_date, '%Y-%m-%d').date()
-            payer_totals = payer_totals.filter(Income.date >= start)
-        except ValueError:
-            pass
-    
-    if end_date:
-        try:
-            end = datetime.strptime(end_date, '%Y-%m-%d').date()
-            payer_totals = payer_totals.filter(Income.date <= end)
-        except ValueError:
-            pass
-    
-    payer_totals = payer_totals.group_by(Income.payer_name).order_by(func.sum(Income.amount).desc()).all()
+    ).filter(*filters).group_by(Income.payer_name).order_by(func.sum(Income.amount).desc()).all()
     
     return render_template('reports/payer.html',
         payer_totals=payer_totals,
@@ -165,45 +242,38 @@ def payer():
         end_date=end_date
     )
 
-@reports_bp.route('/fund-summary')
-@login_required
-def fund_summary():
-    fund_data = {}
+def _fund_summary_data(user_id):
+    accounts = Account.query.filter(
+        Account.user_id == user_id,
+        Account.is_active == True,
+        Account.account_type.in_([AccountType.INCOME, AccountType.EXPENSE, AccountType.ASSET])
+    ).all()
+    balances = Account.get_balances(accounts)
+    
+    totals = {}
+    for account in accounts:
+        key = (account.fund_type, account.account_type)
+        totals[key] = totals.get(key, 0) + balances[account.id]
     
+    fund_data = {}
     for fund_type in FundType.ALL_FUNDS:
-        income_accounts = Account.query.filter_by(
-            user_id=current_user.id,
-            account_type=AccountType.INCOME,
-            fund_type=fund_type,
-            is_active=True
-        ).all()
-        
-        expense_accounts = Account.query.filter_by(
-            user_id=current_user.id,
-            account_type=AccountType.EXPENSE,
-            fund_type=fund_type,
-            is_active=True
-        ).all()
-        
-        asset_accounts = Account.query.filter_by(
-            user_id=current_user.id,
-            account_type=AccountType.ASSET,
-            fund_type=fund_type,
-            is_active=True
-        ).all()
-        
-        total_income = sum(acc.get_balance() for acc in income_accounts)
-        total_expense = sum(acc.get_balance() for acc in expense_accounts)
-        total_assets = sum(acc.get_balance() for acc in asset_accounts)
+        total_income = totals.get((fund_type, AccountType.INCOME), 0)
+        total_expense = totals.get((fund_type, AccountType.EXPENSE), 0)
         
         fund_data[fund_type] = {
             'name': FundType.FUND_NAMES.get(fund_type, fund_type),
             'total_income': total_income,
             'total_expense': total_expense,
             'surplus': total_income - total_expense,
-            'assets': total_assets
+            'assets': totals.get((fund_type, AccountType.ASSET), 0)
         }
     
+    return fund_data
+
+@reports_bp.route('/fund-summary')
+@login_required
+def fund_summary():
+    fund_data = cached_report(current_user.id, 'fund_summary', lambda: _fund_summary_data(current_user.id))
     return render_template('reports/fund_summary.html', fund_data=fund_data)
 
 @reports_bp.route('/export/income-csv')
@@ -212,53 +282,41 @@ def export_income_csv():
     start_date = request.args.get('start_date', '')
     end_date = request.args.get('end_date', '')
     
-    query = Income.query.filter_by(user_id=current_user.id, is_reversed=False)
-    
-    if start_date:
-        try:
-            start = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(Income.date >= start)
-        except ValueError:
-            pass
-    
-    if end_date:
-        try:
-            end = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(Income.date <= end)
-        except ValueError:
-            pass
-    
-    incomes = query.order_by(Income.date.desc()).all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    writer.writerow([
+    query = Income.query.options(load_only(
+        Income.receipt_number, Income.date, Income.time, Income.category, Income.fund_type,
+        Income.source, Income.payer_name, Income.payment_mode, Income.amount, Income.description
+    )).filter_by(user_id=current_user.id, is_reversed=False)
+    
+    start = parse_date(start_date)
+    if start:
+        query = query.filter(Income.date >= start)
+    
+    end = parse_date(end_date)
+    if end:
+        query = query.filter(Income.date <= end)
+    
+    incomes = query.order_by(Income.date.desc()).yield_per(CSV_QUERY_BATCH_SIZE)
+    
+    category_names = IncomeCategory.CATEGORY_NAMES
+    fund_names = FundType.FUND_NAMES
+    
+    rows = ([
+        income.receipt_number,
+        income.date.strftime('%Y-%m-%d'),
+        income.time.strftime('%H:%M'),
+        category_names.get(income.category, income.category),
+        fund_names.get(income.fund_type, income.fund_type),
+        income.source,
+        income.payer_name or '',
+        income.payment_mode,
+        income.amount,
+        income.description or ''
+    ] for income in incomes)
+    
+    return csv_response([
         'Receipt Number', 'Date', 'Time', 'Category', 'Fund Type',
         'Source', 'Payer Name', 'Payment Mode', 'Amount', 'Description'
-    ])
-    
-    for income in incomes:
-        writer.writerow([
-            income.receipt_number,
-            income.date.strftime('%Y-%m-%d'),
-            income.time.strftime('%H:%M'),
-            IncomeCategory.CATEGORY_NAMES.get(income.category, income.category),
-            FundType.FUND_NAMES.get(income.fund_type, income.fund_type),
-            income.source,
-            income.payer_name or '',
-            income.payment_mode,
-            float(income.amount),
-            income.description or ''
-        ])
-    
-    output.seek(0)
-    
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = f'attachment; filename=income_report_{datetime.utcnow().strftime("%Y%m%d")}.csv'
-    
-    return response
+    ], rows, f'income_report_{datetime.utcnow().strftime("%Y%m%d")}.csv')
 
 @reports_bp.route('/export/expense-csv')
 @login_required
@@ -266,142 +324,100 @@ def export_expense_csv():
     start_date = request.args.get('start_date', '')
     end_date = request.args.get('end_date', '')
     
-    query = Expense.query.filter_by(user_id=current_user.id, is_reversed=False)
+    query = Expense.query.options(load_only(
+        Expense.voucher_number, Expense.date, Expense.category, Expense.fund_type,
+        Expense.payee, Expense.description, Expense.payment_mode, Expense.amount
+    )).filter_by(user_id=current_user.id, is_reversed=False)
     
-    if start_date:
-        try:
-            start = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(Expense.date >= start)
-        except ValueError:
-            pass
+    start = parse_date(start_date)
+    if start:
+        query = query.filter(Expense.date >= start)
     
-    if end_date:
-        try:
-            end = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(Expense.date <= end)
-        except ValueError:
-            pass
+    end = parse_date(end_date)
+    if end:
+        query = query.filter(Expense.date <= end)
+    
+    expenses = query.order_by(Expense.date.desc()).yield_per(CSV_QUERY_BATCH_SIZE)
     
-    expenses = query.order_by(Expense.date.desc()).all()
+    category_names = ExpenseCategory.CATEGORY_NAMES
+    fund_names = FundType.FUND_NAMES
     
-    output = io.StringIO()
-    writer = csv.writer(output)
+    rows = ([
+        expense.voucher_number,
+        expense.date.strftime('%Y-%m-%d'),
+        category_names.get(expense.category, expense.category),
+        fund_names.get(expense.fund_type, expense.fund_type),
+        expense.payee,
+        expense.description,
+        expense.payment_mode,
+        expense.amount
+    ] for expense in expenses)
     
-    writer.writerow([
+    return csv_response([
         'Voucher Number', 'Date', 'Category', 'Fund Type',
         'Payee', 'Description', 'Payment Mode', 'Amount'
-    ])
-    
-    for expense in expenses:
-        writer.writerow([
-            expense.voucher_number,
-            expense.date.strftime('%Y-%m-%d'),
-            ExpenseCategory.CATEGORY_NAMES.get(expense.category, expense.category),
-            FundType.FUND_NAMES.get(expense.fund_type, expense.fund_type),
-            expense.payee,
-            expense.description,
-            expense.payment_mode,
-            float(expense.amount)
-        ])
-    
-    output.seek(0)
-    
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = f'attachment; filename=expense_report_{datetime.utcnow().strftime("%Y%m%d")}.csv'
-    
-    return response
+    ], rows, f'expense_report_{datetime.utcnow().strftime("%Y%m%d")}.csv')
 
 @reports_bp.route('/export/trial-balance-pdf')
 @login_required
 def export_trial_balance_pdf():
     as_of_date = request.args.get('as_of_date', '')
     
-    end_date = None
-    if as_of_date:
-        try:
-            end_date = datetime.strptime(as_of_date, '%Y-%m-%d').date()
-        except ValueError:
-            pass
-    
-    accounts = Account.query.filter_by(user_id=current_user.id, is_active=True).order_by(Account.code).all()
-    
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
-    
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        spaceAfter=30,
-        alignment=1
-    )
-    
-    elements.append(Paragraph("Personal Finance Manager", title_style))
-    elements.append(Paragraph("Trial Balance", styles['Heading2']))
+    end_date = parse_date(as_of_date)
     
+    # Whatever the account's normal side, a net debit lands in the Debit column and a net credit in Credit
+    entry_join = JournalEntry.account_id == Account.id
     if end_date:
-        elements.append(Paragraph(f"As of: {end_date.strftime('%d %B %Y')}", styles['Normal']))
-    else:
-        elements.append(Paragraph(f"As of: {datetime.utcnow().strftime('%d %B %Y')}", styles['Normal']))
+        entry_join = db.and_(entry_join, JournalEntry.date <= end_date)
+    net = func.coalesce(func.sum(JournalEntry.debit_amount), 0) - func.coalesce(func.sum(JournalEntry.credit_amount), 0)
     
-    elements.append(Spacer(1, 20))
+    rows = db.session.query(
+        Account.code,
+        Account.name,
+        case((net > 0, net), else_=0).label('debit'),
+        case((net < 0, -net), else_=0).label('credit')
+    ).outerjoin(JournalEntry, entry_join).filter(
+        Account.user_id == current_user.id,
+        Account.is_active == True
+    ).group_by(Account.id, Account.code, Account.name).having(net != 0).order_by(Account.code).all()
     
-    data = [['Account Code', 'Account Name', 'Debit', 'Credit']]
+    as_of = end_date or datetime.utcnow().date()
+    
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pdf.setTitle('Trial Balance')
+    
+    y = A4[1] - PDF_MARGIN - 18
+    pdf.setFont('Helvetica-Bold', 18)
+    pdf.drawCentredString(A4[0] / 2, y, "Personal Finance Manager")
+    y -= 40
+    pdf.setFont('Helvetica-Bold', 14)
+    pdf.drawString(TRIAL_BALANCE_LEFT, y, "Trial Balance")
+    y -= 20
+    pdf.setFont('Helvetica', 10)
+    pdf.drawString(TRIAL_BALANCE_LEFT, y, f"As of: {as_of.strftime('%d %B %Y')}")
+    y -= 20 + TRIAL_BALANCE_ROW_HEIGHT
+    
+    _draw_trial_balance_row(pdf, y, [title for _, title in TRIAL_BALANCE_COLUMNS], header=True)
     
     total_debit = Decimal('0')
     total_credit = Decimal('0')
     
-    for account in accounts:
-        balance = account.get_balance(end_date=end_date)
-        
-        if balance != 0:
-            if account.account_type in [AccountType.ASSET, AccountType.EXPENSE]:
-                if balance >= 0:
-                    debit = balance
-                    credit = Decimal('0')
-                else:
-                    debit = Decimal('0')
-                    credit = abs(balance)
-            else:
-                if balance >= 0:
-                    debit = Decimal('0')
-                    credit = balance
-                else:
-                    debit = abs(balance)
-                    credit = Decimal('0')
-            
-            data.append([
-                account.code,
-                account.name,
-                f"{debit:,.2f}" if debit else '',
-                f"{credit:,.2f}" if credit else ''
-            ])
-            total_debit += debit
-            total_credit += credit
-    
-    data.append(['', 'Total', f"{total_debit:,.2f}", f"{total_credit:,.2f}"])
-    
-    table = Table(data, colWidths=[80, 250, 100, 100])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('ALIGN', (1, 1), (1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
-    
-    elements.append(table)
-    
-    doc.build(elements)
+    for code, name, debit, credit in rows:
+        y = _next_trial_balance_row(pdf, y)
+        _draw_trial_balance_row(pdf, y, [
+            code,
+            name,
+            f"{debit:,.2f}" if debit else '',
+            f"{credit:,.2f}" if credit else ''
+        ])
+        total_debit += debit
+        total_credit += credit
+    
+    y = _next_trial_balance_row(pdf, y)
+    _draw_trial_balance_row(pdf, y, ['', 'Total', f"{total_debit:,.2f}", f"{total_credit:,.2f}"], total=True)
+    
+    pdf.save()
     buffer.seek(0)
     
     return send_file(